@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Configuration
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))  # Cosine similarity of the queries
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+
+class SemanticAnswerCache:
+    """Generated answers reused for paraphrased questions.
+
+    An answer is only reused when the new query retrieved exactly the same
+    chunks (by vector ID) and its embedding is at least ``threshold``
+    cosine-similar to the query that produced the answer. The LLM would
+    get almost the same prompt again, so it would give almost the same
+    answer. Settings that shape the answer (model, bot name, context size)
+    are part of the key too.
+
+    Entries are dropped when one of their source documents is re-ingested
+    or deleted. Re-ingested or deleted chunks never come back with the same
+    vector IDs either, so entries from before a change in another worker
+    simply stop matching.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # (settings, vector IDs) -> list of entries, each with the query vector, answer and sources
+        self._groups: Dict[tuple, List[Dict]] = {}
+        self._order: OrderedDict = OrderedDict()  # id(entry) -> (group key, entry), oldest first
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(settings: tuple, docs: List[Dict]) -> tuple:
+        return settings, frozenset(doc.get('vector_id') for doc in docs)
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, query_embedding, docs: List[Dict], settings: tuple) -> Optional[str]:
+        """The stored answer for a similar query over the same documents, if any"""
+        key = self._key(settings, docs)
+        query = self._unit(query_embedding)
+        now = time.time()
+        with self._lock:
+            best, best_score = None, self.threshold
+            for entry in self._groups.get(key, ()):
+                if entry['expires_at'] <= now:
+                    continue
+                score = float(entry['query'] @ query)
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._order.move_to_end(id(best))
+            return best['answer']
+
+    def put(self, query_embedding, docs: List[Dict], settings: tuple, answer: str):
+        """Store an answer; blank answers (e.g. a cut-off reasoning block) are never reused"""
+        if not answer or not answer.strip():
+            return
+        key = self._key(settings, docs)
+        entry = {
+            'query': self._unit(query_embedding),
+            'answer': answer,
+            'doc_ids': {doc.get('doc_id') for doc in docs},
+            'expires_at': time.time() + self.ttl
+        }
+        with self._lock:
+            self._groups.setdefault(key, []).append(entry)
+            self._order[id(entry)] = (key, entry)
+            while len(self._order) > self.max_entries:
+                _, (old_key, old_entry) = self._order.popitem(last=False)
+                self._discard(old_key, old_entry)
+
+    def _discard(self, key: tuple, entry: Dict):
+        group = self._groups.get(key, [])
+        group.remove(entry)
+        if not group:
+            del self._groups[key]
+
+    def invalidate_documents(self, doc_ids: Iterable[str]):
+        """Drop every answer that drew on one of these documents"""
+        doc_ids = set(doc_ids)
+        with self._lock:
+            for entry_id, (key, entry) in list(self._order.items()):
+                if entry['doc_ids'] & doc_ids:
+                    del self._order[entry_id]
+                    self._discard(key, entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._order),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
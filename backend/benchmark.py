@@ -0,0 +1,384 @@
+"""End-to-end benchmark of the ingestion and chat paths against the local providers.
+
+Builds a synthetic corpus of each requested size in a scratch directory and
+times every stage: bulk inserts (``_update_vector_store``), compaction,
+reopening the store, ``search_relevant_documents``, ``generate_response``,
+``process_urls`` over generated HTML pages served from localhost, and
+``process_pdf`` over generated PDFs. Nothing leaves the machine: embeddings
+come from HashEmbeddings and answers from CannedCompletions.
+
+    python benchmark.py --sizes 1000,10000,100000 --output bench.json
+    python benchmark.py --sizes 1000,10000 --compare bench.json
+
+Each stage reports throughput, p50/p95/p99 latency and the peak RSS of this
+process while it ran. With ``--compare`` the run is checked against earlier
+results and the exit status is 1 if any stage got slower than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is only sampled from /proc, which it lacks too
+    resource = None
+
+from vector_store import VectorStore, EMBEDDING_DIM
+from data_processor import DataProcessor, Chatbot
+from providers import HashEmbeddings, CannedCompletions
+from crawler import Crawler, CRAWL_WORKERS
+
+# Configuration
+BENCH_SEED = 1234
+BENCH_VOCABULARY = 5000
+BENCH_WORDS_PER_CHUNK = 150
+RSS_SAMPLE_INTERVAL = 0.01
+REGRESSION_TOLERANCE = 0.10  # Allowed slowdown of p95 latency or throughput against a baseline
+
+_SYLLABLES = ["ba", "ko", "ri", "tan", "sel", "mu", "de", "vor", "qui", "len", "pa", "zu", "fin", "gro", "tel", "shi"]
+
+def _vocabulary(rng: np.random.Generator, size: int) -> np.ndarray:
+    words = {"".join(rng.choice(_SYLLABLES, size=rng.integers(2, 5))) for _ in range(size * 2)}
+    return np.array(sorted(words)[:size])
+
+class Corpus:
+    """Deterministic synthetic text: Zipf-distributed words, so term statistics look like real prose"""
+
+    def __init__(self, seed: int = BENCH_SEED, vocabulary: int = BENCH_VOCABULARY):
+        self.rng = np.random.default_rng(seed)
+        self.words = _vocabulary(self.rng, vocabulary)
+        ranks = np.arange(1, len(self.words) + 1)
+        self.weights = (1.0 / ranks) / (1.0 / ranks).sum()
+
+    def text(self, words: int = BENCH_WORDS_PER_CHUNK) -> str:
+        picked = self.words[self.rng.choice(len(self.words), size=words, p=self.weights)]
+        # Sentences of 8-20 words, so chunking finds boundaries
+        sentences, pos = [], 0
+        while pos < len(picked):
+            length = int(self.rng.integers(8, 21))
+            sentence = " ".join(picked[pos:pos + length])
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            pos += length
+        return " ".join(sentences)
+
+    def query(self, source_text: str) -> str:
+        """A question about a stored passage, built from a run of its words"""
+        words = source_text.rstrip(".").split()
+        start = int(self.rng.integers(0, max(1, len(words) - 8)))
+        return "What about " + " ".join(words[start:start + 6]).lower().replace(".", "") + "?"
+
+class RssSampler:
+    """Peak resident set size of this process over a block, sampled from /proc"""
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            if resource is None:
+                return 0
+            # Lifetime peak in KiB on Linux: an upper bound when /proc is missing
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+def _summary(stage: str, size: int, latencies: List[float], items: int, elapsed: float, peak_rss: int) -> Dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'stage': stage,
+        'size': size,
+        'calls': len(latencies),
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'throughput': round(items / elapsed, 2) if elapsed else 0.0,  # Items per second
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3) if len(latencies) else 0.0,
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3) if len(latencies) else 0.0,
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3) if len(latencies) else 0.0,
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1)
+    }
+
+def _report(result: Dict) -> Dict:
+    print(f"  {result['stage']:<26} {result['throughput']:>10.1f}/s  p50 {result['p50_ms']:>9.2f} ms  "
+          f"p95 {result['p95_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms  rss {result['peak_rss_mb']} MB")
+    return result
+
+def measure(stage: str, size: int, calls: Iterable[Callable[[], int]]) -> Dict:
+    """Run each call (returning the number of items it handled) in turn and summarize the stage.
+
+    ``calls`` may be a generator; only the calls themselves are timed, so
+    preparing the next one (generating and embedding its input) is not.
+    """
+    latencies, items = [], 0
+    with RssSampler() as rss:
+        for call in calls:
+            t = time.perf_counter()
+            items += call()
+            latencies.append(time.perf_counter() - t)
+    return _report(_summary(stage, size, latencies, items, sum(latencies), rss.peak))
+
+class _PageServer:
+    """Serves generated HTML pages from memory on a localhost port"""
+
+    def __init__(self, pages: Dict[str, str]):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="bench-http", daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _html_page(corpus: Corpus, title: str, paragraphs: int) -> str:
+    body = "".join(f"<p>{corpus.text()}</p>" for _ in range(paragraphs))
+    return (f"<html><head><title>{title}</title><script>var x = 1;</script></head>"
+            f"<body><nav>Home | About</nav><main><h1>{title}</h1>{body}</main><footer>Footer</footer></body></html>")
+
+def _write_pdf(path: str, corpus: Corpus, pages: int):
+    from PyPDF2 import PdfWriter, PageObject
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica')
+    }))
+    for _ in range(pages):
+        page = PageObject.create_blank_page(None, 612, 792)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+        })
+        words = corpus.text(300).split()
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        stream = DecodedStreamObject()
+        stream.set_data(("BT /F1 10 Tf 12 TL 40 750 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET").encode())
+        page[NameObject('/Contents')] = writer._add_object(stream)
+        writer.add_page(page)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+def run_size(size: int, args, corpus: Corpus) -> List[Dict]:
+    """Build a corpus of ``size`` vectors in a scratch directory and time every stage on it"""
+    print(f"\n== {size} vectors ==")
+    workdir = tempfile.mkdtemp(prefix=f"bench-{size}-")
+    previous = os.getcwd()
+    os.chdir(workdir)  # The caches, logs and uploads use relative paths
+    server = None
+    try:
+        os.makedirs("uploads", exist_ok=True)
+        store = VectorStore(index_file="bench.faiss", metadata_file="bench_metadata.json", wal_file="bench.wal",
+                            config_file="bench_config.json", vectors_file="bench_vectors.npy",
+                            metadata_db="bench_metadata.db")
+        if args.index_type != store.index_type:
+            store.configure(args.index_type)
+        embedder = HashEmbeddings(dim=EMBEDDING_DIM)
+        processor = DataProcessor(store, embedder=embedder)
+        # Politeness delays would measure the sleep, not the pipeline
+        processor.crawler = Crawler(per_host=CRAWL_WORKERS, host_delay=0)
+        chatbot = Chatbot(processor, llm=CannedCompletions())
+        results = []
+
+        # Bulk inserts: one call per synthetic document of ``batch`` chunks
+        sample_texts = []
+
+        def inserts():
+            for doc in range(0, size, args.batch):
+                count = min(args.batch, size - doc)
+                texts = [corpus.text() for _ in range(count)]
+                sample_texts.append(texts[0])
+                chunks = [{
+                    'source': f"https://bench.local/doc/{doc}", 'type': 'url',
+                    'added_date': datetime.now().isoformat(), 'doc_id': f"bench-{doc}",
+                    'chunk_index': i, 'page': None, 'offset': None, 'text': text
+                } for i, text in enumerate(texts)]
+                if args.random_vectors:
+                    vectors = corpus.rng.standard_normal((count, EMBEDDING_DIM)).astype('float32')
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                else:
+                    vectors = embedder.embed(texts, "search_document")
+                yield lambda: (processor._update_vector_store(vectors, chunks), len(chunks))[1]
+        results.append(measure("update_vector_store", size, inserts()))
+
+        results.append(measure("compact", size, [lambda: (store.compact(), store.ntotal)[1]]))
+
+        def reopen():
+            VectorStore(index_file="bench.faiss", metadata_file="bench_metadata.json", wal_file="bench.wal",
+                        config_file="bench_config.json", vectors_file="bench_vectors.npy",
+                        metadata_db="bench_metadata.db")
+            return 1
+        results.append(measure("open_store", size, [reopen] * 3))
+
+        queries = [corpus.query(sample_texts[i % len(sample_texts)]) for i in range(args.queries)]
+        results.append(measure("search_relevant_documents", size,
+                               [lambda q=q: (processor.search_relevant_documents(q), 1)[1] for q in queries]))
+        # New questions, so neither the query nor the answer cache hides the work
+        queries = [corpus.query(sample_texts[i % len(sample_texts)]) + f" ({i})" for i in range(args.queries)]
+        results.append(measure("generate_response", size,
+                               [lambda q=q: (chatbot.generate_response(q), 1)[1] for q in queries]))
+
+        if args.pages:
+            pages = {f"/page/{n}": _html_page(corpus, f"Page {n}", args.paragraphs) for n in range(args.pages)}
+            server = _PageServer(pages)
+            urls = [server.base_url + path for path in pages]
+            original = processor.process_url
+            latencies = []
+
+            def timed(url):
+                t = time.perf_counter()
+                try:
+                    return original(url)
+                finally:
+                    latencies.append(time.perf_counter() - t)
+            processor.process_url = timed
+            with RssSampler() as rss:
+                started = time.perf_counter()
+                processed = processor.process_urls(urls)
+                elapsed = time.perf_counter() - started
+            failed = [r for r in processed if r['status'] == 'error']
+            if failed:
+                print(f"  process_urls: {len(failed)} pages failed: {failed[0]['message']}")
+            # Pages are fetched concurrently, so throughput is over wall time, not summed latency
+            results.append(_report(_summary("process_urls", size, latencies, len(processed) - len(failed),
+                                            elapsed, rss.peak)))
+
+        if args.pdfs:
+            paths = []
+            for n in range(args.pdfs):
+                path = os.path.join("uploads", f"bench-{n}.pdf")
+                _write_pdf(path, corpus, args.pdf_pages)
+                paths.append(path)
+            results.append(measure("process_pdf", size,
+                                   [lambda path=path: args.pdf_pages if processor.process_pdf(path)['status'] != 'error' else 0
+                                    for path in paths]))
+        chatbot.save_memory()
+        return results
+    finally:
+        if server is not None:
+            server.close()
+        os.chdir(previous)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Stages (matched by stage and size) whose p95 latency or throughput regressed beyond ``tolerance``"""
+    previous = {(r['stage'], r['size']): r for r in baseline.get('results', [])}
+    regressions = []
+    print(f"\nAgainst {baseline.get('commit', 'baseline')} ({baseline.get('timestamp', '?')}):")
+    for result in results:
+        old = previous.get((result['stage'], result['size']))
+        if old is None:
+            continue
+        p95 = result['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+        throughput = result['throughput'] / old['throughput'] - 1 if old['throughput'] else 0.0
+        slower = p95 > tolerance or throughput < -tolerance
+        print(f"  {result['stage']:<26} {result['size']:>9}  p95 {p95:+7.1%}  throughput {throughput:+7.1%}"
+              + ("  REGRESSION" if slower else ""))
+        if slower:
+            regressions.append(f"{result['stage']}@{result['size']}")
+    return regressions
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and chat against local providers")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma-separated corpus sizes in vectors (1k..1M)")
+    parser.add_argument("--batch", type=int, default=100, help="Chunks per _update_vector_store call")
+    parser.add_argument("--queries", type=int, default=200, help="Queries for the search and chat stages")
+    parser.add_argument("--pages", type=int, default=50, help="Generated HTML pages for process_urls (0 to skip)")
+    parser.add_argument("--paragraphs", type=int, default=10, help="Paragraphs per generated page")
+    parser.add_argument("--pdfs", type=int, default=5, help="Generated PDFs for process_pdf (0 to skip)")
+    parser.add_argument("--pdf-pages", type=int, default=20, help="Pages per generated PDF")
+    parser.add_argument("--index-type", default="flat_ip", help="Vector index type to benchmark")
+    parser.add_argument("--random-vectors", action="store_true",
+                        help="Bulk-load random vectors instead of hash embeddings (faster for 1M; "
+                             "searches then rarely pass the rerank cutoff)")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Allowed relative slowdown before a stage counts as a regression")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directories")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        # Read first: the new results may be written over the baseline file
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    corpus = Corpus()
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        results.extend(run_size(size, args, corpus))
+
+    report = {
+        'commit': _commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+        'results': results
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
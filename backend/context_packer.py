@@ -0,0 +1,139 @@
+import os
+import re
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError:  # Optional: token counts fall back to an approximation
+    tiktoken = None
+
+# Configuration
+CONTEXT_TOKENIZER = os.environ.get("CONTEXT_TOKENIZER", "cl100k_base")  # tiktoken encoding used for counting
+CHARS_PER_TOKEN = 4  # Converts the character-based max context setting into a token budget
+MIN_PASSAGE_TOKENS = 40  # A passage is not cut shorter than this to fill the rest of the budget
+PASSAGE_SEPARATOR = "\n\n"
+
+# Words and single punctuation marks; BPE splits long or rare words further, hence the length floor
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r'[.!?]\s|\n')
+
+class TokenCounter:
+    """Token counts with tiktoken when it is installed, else a fast regex approximation"""
+
+    def __init__(self, encoding: str = CONTEXT_TOKENIZER):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:  # Unknown encoding, or its vocabulary cannot be downloaded
+                print(f"Tokenizer {encoding} unavailable, approximating token counts: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return max(len(_APPROX_TOKEN.findall(text)), (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of ``text`` within ``max_tokens``, cut at a sentence end where possible"""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        cut = len(text) * max_tokens // tokens
+        while cut > 0:
+            prefix = text[:cut]
+            ends = [match.end() for match in _SENTENCE_END.finditer(prefix)]
+            if ends and ends[-1] > cut // 2:
+                prefix = prefix[:ends[-1]]
+            elif ' ' in prefix:
+                prefix = prefix[:prefix.rindex(' ')]
+            prefix = prefix.rstrip()
+            if self.count(prefix) <= max_tokens:
+                return prefix
+            cut = len(prefix) * 9 // 10
+        return ""
+
+def _merge_overlapping(docs: List[Dict]) -> List[Dict]:
+    """Merge chunks of the same page whose character spans overlap into one passage.
+
+    Adjacent chunks of a document share up to CHUNK_OVERLAP characters, so
+    two of them in the results would repeat that text. Each passage keeps
+    the position of its best-ranked chunk.
+    """
+    passages = []
+    spans = {}  # (doc_id, page) -> passages with a known span in that page
+    for doc in docs:
+        text = doc.get('text') or ""
+        offset = doc.get('offset')
+        key = (doc.get('doc_id') or doc.get('source'), doc.get('page'))
+        if offset is None:
+            passages.append({'docs': [doc], 'text': text})
+            continue
+        start, end = offset, offset + len(text)
+        for passage in spans.get(key, []):
+            if start <= passage['end'] and passage['start'] <= end:
+                # Chunks are exact slices of the page, so the union is spliced by offset
+                if start < passage['start']:
+                    passage['text'] = text + passage['text'][end - passage['start']:] if end < passage['end'] else text
+                elif end > passage['end']:
+                    passage['text'] += text[passage['end'] - start:]
+                passage['start'], passage['end'] = min(start, passage['start']), max(end, passage['end'])
+                passage['docs'].append(doc)
+                break
+        else:
+            passage = {'docs': [doc], 'text': text, 'start': start, 'end': end}
+            spans.setdefault(key, []).append(passage)
+            passages.append(passage)
+    return passages
+
+class ContextPacker:
+    """Assemble the prompt context from retrieved passages within a token budget.
+
+    Overlapping chunks of the same page are merged, and passages whose text
+    is already contained in a chosen one (the same content under two
+    sources) are dropped. The rest are taken in relevance order while they fit; the
+    first passage that does not fit is cut at a sentence end to use the
+    remaining budget, as long as at least MIN_PASSAGE_TOKENS remain.
+    """
+
+    def __init__(self, counter: TokenCounter = None):
+        self.counter = counter or TokenCounter()
+
+    def pack(self, docs: List[Dict], budget: int) -> Dict:
+        """Pack ``docs`` (best first) into at most ``budget`` tokens.
+
+        Returns the context ``text``, the ``tokens`` it uses, the ``budget``,
+        and the ``docs`` whose text made it into the context.
+        """
+        separator_tokens = self.counter.count(PASSAGE_SEPARATOR)
+        chosen = []
+        used = 0
+        seen = []  # Normalized text of the chosen passages
+        for passage in _merge_overlapping(docs):
+            text = passage['text'].strip()
+            fingerprint = " ".join(text.lower().split())
+            if not text or any(fingerprint in chosen_text for chosen_text in seen):
+                continue
+            cost = separator_tokens if chosen else 0
+            remaining = budget - used - cost
+            tokens = self.counter.count(text)
+            if tokens > remaining:
+                if remaining < MIN_PASSAGE_TOKENS:
+                    continue  # A later, shorter passage may still fit
+                text = self.counter.truncate(text, remaining)
+                if not text:
+                    continue
+                tokens = self.counter.count(text)
+            seen.append(" ".join(text.lower().split()))
+            chosen.append((passage, text))
+            used += cost + tokens
+
+        return {
+            'text': PASSAGE_SEPARATOR.join(text for _, text in chosen),
+            'tokens': used,
+            'budget': budget,
+            'docs': [doc for passage, _ in chosen for doc in passage['docs']]
+        }
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+# Configuration
+CONVERSATION_LOG_FILE = "chatbot_memory.jsonl"
+CONVERSATION_MEMORY_SIZE = int(os.environ.get("CONVERSATION_MEMORY_SIZE", "1000"))  # Exchanges kept in RAM
+CONVERSATION_FLUSH_INTERVAL = float(os.environ.get("CONVERSATION_FLUSH_INTERVAL", "1.0"))
+CONVERSATION_FLUSH_BATCH = 256
+CONVERSATION_QUEUE_SIZE = 10000
+CONVERSATION_LOG_MAX_BYTES = int(os.environ.get("CONVERSATION_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+CONVERSATION_LOG_BACKUPS = int(os.environ.get("CONVERSATION_LOG_BACKUPS", "5"))  # Rotated files kept
+
+class ConversationLog:
+    """Bounded in-memory conversation history backed by an append-only JSONL log.
+
+    ``append`` only touches memory: the exchange goes into a ring buffer of
+    the ``memory_size`` most recent exchanges and onto a queue. A background
+    thread drains the queue every ``flush_interval`` seconds and writes each
+    batch with a single append. When the log grows past ``max_bytes`` it is
+    rotated to ``<file>.1`` and so on, and only ``backups`` rotated files
+    are kept.
+    """
+
+    def __init__(self, log_file: str = CONVERSATION_LOG_FILE, memory_size: int = CONVERSATION_MEMORY_SIZE,
+                 flush_interval: float = CONVERSATION_FLUSH_INTERVAL, max_bytes: int = CONVERSATION_LOG_MAX_BYTES,
+                 backups: int = CONVERSATION_LOG_BACKUPS):
+        self.log_file = log_file
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self.recent = deque(maxlen=memory_size)
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=CONVERSATION_QUEUE_SIZE)
+        self.dropped = 0  # Exchanges never written to the log because the queue was full
+
+        self._load_recent()
+        self._flusher = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _load_recent(self):
+        """Fill the ring buffer from the end of the current log"""
+        if not os.path.exists(self.log_file):
+            return
+        try:
+            with open(self.log_file, 'rb') as f:
+                # The log is capped at max_bytes, so this read is bounded too
+                lines = deque(f, maxlen=self.recent.maxlen)
+        except OSError as e:
+            print(f"Error loading conversation log: {e}")
+            return
+        for line in lines:
+            try:
+                self.recent.append(json.loads(line))
+            except ValueError:
+                continue  # Torn last line from a crash
+
+    def migrate_json(self, json_file: str):
+        """Move a legacy JSON list of exchanges into the log"""
+        migrated = json_file + ".migrated"
+        try:
+            # Whoever wins the rename does the import, so concurrent workers never import twice
+            os.replace(json_file, migrated)
+        except OSError:
+            return
+        try:
+            with open(migrated, 'r') as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error migrating {json_file}: {e}")
+            return
+        self._write(records)
+        with self._lock:
+            self.recent.extend(records[-self.recent.maxlen:])
+        print(f"Migrated {len(records)} conversation records from {json_file}")
+
+    def append(self, query: str, response: str):
+        """Record an exchange; never blocks on disk"""
+        record = {
+            "query": query,
+            "response": response,
+            "timestamp": datetime.now().isoformat()
+        }
+        with self._lock:
+            self.recent.append(record)
+        try:
+            self._pending.put_nowait(record)
+        except queue.Full:
+            # The disk is far behind; keep serving chats and drop the log line
+            with self._lock:
+                self.dropped += 1
+                if self.dropped == 1:
+                    print("Conversation log is falling behind; dropping log lines (see /stats)")
+
+    def history(self) -> List[Dict]:
+        with self._lock:
+            return list(self.recent)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'recent': len(self.recent),
+                'pending': self._pending.qsize(),
+                'dropped': self.dropped
+            }
+
+    def flush(self):
+        """Block until everything appended so far is on disk"""
+        self._pending.join()
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            # Let more exchanges accumulate so one write covers many
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < CONVERSATION_FLUSH_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Error writing conversation log: {e}")
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _write(self, records: List[Dict]):
+        payload = "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+        while True:
+            with open(self.log_file, 'ab') as f:
+                # Other workers append to the same log; rotate and write under one lock
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if not self._still_current(f):
+                        continue  # Another worker rotated the log while we waited
+                    size = os.fstat(f.fileno()).st_size
+                    if size and size + len(payload) > self.max_bytes:
+                        self._rotate()
+                        continue
+                    f.write(payload)
+                    return
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _still_current(self, f) -> bool:
+        """Whether ``f`` is still the live log and not a file another worker just rotated away"""
+        try:
+            return os.stat(self.log_file).st_ino == os.fstat(f.fileno()).st_ino
+        except OSError:
+            return False
+
+    def _rotate(self):
+        """Shift <file>.N to <file>.N+1, dropping the oldest, and move the live log to <file>.1"""
+        if self.backups <= 0:
+            os.remove(self.log_file)
+            return
+        for n in range(self.backups - 1, 0, -1):
+            older = f"{self.log_file}.{n}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.log_file}.{n + 1}")
+        os.replace(self.log_file, f"{self.log_file}.1")
@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configuration
+CRAWL_WORKERS = int(os.environ.get("CRAWL_WORKERS", "16"))
+CRAWL_PER_HOST = int(os.environ.get("CRAWL_PER_HOST", "4"))
+CRAWL_HOST_DELAY = float(os.environ.get("CRAWL_HOST_DELAY", "0.1"))
+CRAWL_TIMEOUT = float(os.environ.get("CRAWL_TIMEOUT", "10"))
+
+class Crawler:
+    """Concurrent page fetcher with a pooled keep-alive session and per-host politeness.
+
+    ``fetch`` can be called from any thread: at most ``per_host`` requests
+    run against one host at a time, and request starts to the same host are
+    spaced at least ``host_delay`` seconds apart. ``map`` runs a whole
+    per-URL pipeline (fetch, extract, embed, insert) on the shared worker
+    pool, so one page's embedding overlaps the next page's download.
+    """
+
+    def __init__(self, max_workers: int = CRAWL_WORKERS, per_host: int = CRAWL_PER_HOST,
+                 host_delay: float = CRAWL_HOST_DELAY, timeout: float = CRAWL_TIMEOUT):
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504])
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crawl")
+
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_next_start: Dict[str, float] = {}
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _wait_for_turn(self, host: str):
+        """Sleep until this host may receive another request"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._host_next_start.get(host, now))
+            self._host_next_start[host] = start + self.host_delay
+        if start > now:
+            time.sleep(start - now)
+
+    def fetch(self, url: str) -> requests.Response:
+        """GET a URL through the pooled session, respecting the per-host limits"""
+        host = urlparse(url).netloc
+        with self._host_slot(host):
+            self._wait_for_turn(host)
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def map(self, fn: Callable[[str], Any], urls: List[str]) -> List[Any]:
+        """Run ``fn`` for every URL on the worker pool; results are returned in input order"""
+        futures = [self.executor.submit(fn, url) for url in urls]
+        return [future.result() for future in futures]
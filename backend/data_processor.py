@@ -1,138 +1,288 @@
 import os
-import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import PyPDF2
-from io import BytesIO
-import faiss
 import numpy as np
-from groq import Groq
-from typing import List, Dict, Optional, Any
-import json
-import time
-import cohere
+from typing import List, Dict, Optional, Any, Iterator, Callable
 import hashlib
-import uuid
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from vector_store import VectorStore
+from metadata_store import MetadataStore
+from embedding_batcher import EmbeddingBatcher
+from crawler import Crawler
+from pdf_extractor import PdfExtractor, PdfSource
+from query_cache import QueryEmbeddingCache
+from answer_cache import SemanticAnswerCache
+from conversation_log import ConversationLog
+from context_packer import ContextPacker, CHARS_PER_TOKEN
+from reranker import Reranker, make_reranker, RERANKER, RERANK_CANDIDATES
+from providers import (EmbeddingProvider, CompletionProvider, make_embedding_provider, make_completion_provider,
+                       EMBED_CONCURRENCY)
 
 # Initialize APIs with default keys
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "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")
 COHERE_API_KEY = os.environ.get("COHERE_API_KEY", "R8KB9BMGC7CftCAt1TLHgu9os1NZjieGhsE3j0oI")
 
-# Configuration
-EMBEDDING_MODEL = "embed-english-v3.0"
-EMBEDDING_DIM = 1024
-DATA_STORE_FILE = "company_data_store.faiss"
-METADATA_FILE = "company_metadata.json"
-MAX_CONTEXT_LENGTH = 4000
+# Chunking of ingested documents (characters)
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "200"))
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Chat worker pool; limits per upstream API live with the providers
+CHAT_WORKERS = int(os.environ.get("CHAT_WORKERS", "32"))
+
+# Hybrid retrieval: dense (FAISS) and keyword (BM25) results merged by reciprocal-rank fusion
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))  # Fetched from each retriever before fusion
+RRF_K = 60
+QUERY_EMBED_TIMEOUT = float(os.environ.get("QUERY_EMBED_TIMEOUT", "5"))  # Then answer from keyword search alone
+
+# Paragraph breaks, sentence ends and line breaks, in order of preference
+_SEGMENT_BOUNDARY = re.compile(r'\n\s*\n|(?<=[.!?])\s+|\n')
+
+def _text_segments(text: str, max_size: int) -> List[tuple]:
+    """Split text into (start, end) spans at paragraph/sentence boundaries, none longer than max_size"""
+    spans = []
+    pos = 0
+    for match in _SEGMENT_BOUNDARY.finditer(text):
+        if match.start() > pos:
+            spans.append((pos, match.start()))
+        pos = match.end()
+    if pos < len(text):
+        spans.append((pos, len(text)))
+    
+    segments = []
+    for start, end in spans:
+        while start < end and text[start].isspace():
+            start += 1
+        # Hard-wrap run-on text, preferring to break at a space
+        while end - start > max_size:
+            cut = text.rfind(' ', start + 1, start + max_size)
+            if cut == -1:
+                cut = start + max_size
+            segments.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if end > start:
+            segments.append((start, end))
+    return segments
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[tuple]:
+    """Split text into overlapping chunks along sentence and paragraph boundaries.
+
+    Returns a list of (offset, chunk) pairs, where offset is the position of
+    the chunk in ``text``. Consecutive chunks share up to ``overlap``
+    characters of whole sentences.
+    """
+    segments = _text_segments(text, chunk_size)
+    chunks = []
+    i = 0
+    while i < len(segments):
+        start = segments[i][0]
+        j = i + 1
+        while j < len(segments) and segments[j][1] - start <= chunk_size:
+            j += 1
+        end = segments[j - 1][1]
+        chunks.append((start, text[start:end]))
+        if j == len(segments):
+            break
+        
+        # Start the next chunk on the trailing segments that fit in the overlap
+        k = j
+        while k - 1 > i and end - segments[k - 1][0] <= overlap:
+            k -= 1
+        i = k
+    return chunks
 
 class DataProcessor:
-    def __init__(self):
-        # Initialize clients
-        self.cohere_api_key = COHERE_API_KEY
-        self.cohere_client = cohere.Client(self.cohere_api_key)
+    def __init__(self, store: VectorStore = None, embedder: EmbeddingProvider = None):
+        # Embedding provider (EMBEDDING_PROVIDER): Cohere, or local hash embeddings for offline runs
+        self.embedder = embedder or make_embedding_provider(api_key=COHERE_API_KEY)
+        # Document embeddings from every ingestion job go through one batcher
+        self.embedding_batcher = EmbeddingBatcher(lambda texts: self._embed(texts, "search_document"))
+        self.crawler = Crawler()
+        self.pdf_extractor = PdfExtractor()
+        # Repeated chat questions skip the query embedding round-trip
+        self.query_cache = QueryEmbeddingCache()
+        # Query embeddings and keyword searches run side by side; keyword results can also stand in alone
+        self.query_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="query-embed")
+        self.lexical_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="keyword-search")
         
-        self.vector_store = None
-        self.metadata = []
+        # The store is shared with every other user of this knowledge base
+        self.store = store or VectorStore()
+        self._store_generation = None
         self.url_hashes = set()
         self.pdf_hashes = set()
+        # Called with the doc_ids of documents that were (re-)ingested or deleted
+        self.document_listeners: List[Callable[[set], None]] = []
+        # Retrieved candidates are rescored, and off-topic ones dropped, before prompting
+        self.reranker: Reranker = make_reranker(RERANKER, self.store)
+        self.queries_below_cutoff = 0
         self.initialize_vector_store()
+
+    @property
+    def vector_store(self):
+        return self.store.index
+
+    @property
+    def metadata(self) -> MetadataStore:
+        return self.store.metadata
         
+    @property
+    def embedding_model(self) -> str:
+        return self.embedder.model
+    
     def update_api_keys(self, cohere_api_key: str):
         """Update the Cohere API key"""
-        self.cohere_api_key = cohere_api_key
-        self.cohere_client = cohere.Client(self.cohere_api_key)
+        self.embedder.set_api_key(cohere_api_key)
         
-    def update_settings(self, embedding_model: str, max_context: int):
-        """Update the embedding model and max context settings"""
-        global EMBEDDING_MODEL, MAX_CONTEXT_LENGTH
-        EMBEDDING_MODEL = embedding_model
-        MAX_CONTEXT_LENGTH = max_context
+    def update_settings(self, embedding_model: str):
+        """Update the embedding model; maxContext only sizes the chatbot's prompt context"""
+        if embedding_model != self.embedder.model:
+            # Query embeddings from another model are useless against the new one
+            self.query_cache.invalidate(keep_model=embedding_model)
+        self.embedder.model = embedding_model
+    
+    def update_index_settings(self, index_type: str = None, ef_search: int = None, nprobe: int = None):
+        """Switch the vector index type (rebuilding it if needed) and its search knobs"""
+        self.store.configure(index_type, ef_search, nprobe)
         
+    def build_reranker(self, reranker: str = None, min_score: float = None) -> Optional[Reranker]:
+        """The new reranker a switch calls for, not yet in use (None if unchanged); raises ValueError if unavailable"""
+        name = reranker or self.reranker.name
+        if name == self.reranker.name:
+            return None
+        return make_reranker(name, self.store, min_score)
+    
+    def update_rerank_settings(self, reranker: str = None, min_score: float = None, built: Reranker = None):
+        """Switch the reranker (or to one from build_reranker) and/or its relevance cutoff"""
+        built = built or self.build_reranker(reranker, min_score)
+        if built is not None:
+            self.reranker = built
+        elif min_score is not None:
+            self.reranker.min_score = min_score
+    
     def initialize_vector_store(self):
-        if os.path.exists(DATA_STORE_FILE):
-            self.vector_store = faiss.read_index(DATA_STORE_FILE)
-            with open(METADATA_FILE, 'r') as f:
-                self.metadata = json.load(f)
-                # Initialize hashes from existing metadata
-                for item in self.metadata:
-                    if item['type'] == 'url':
-                        self.url_hashes.add(self._hash_url(item['source']))
-                    elif item['type'] == 'pdf':
-                        self.pdf_hashes.add(self._hash_file(item['source']))
-        else:
-            self.vector_store = faiss.IndexFlatL2(EMBEDDING_DIM)
-            self.metadata = []
-            self.url_hashes = set()
-            self.pdf_hashes = set()
+        """Bring the resident store up to date, reloading only if the files on disk changed"""
+        self.store.refresh()
+        if self.store.generation == self._store_generation:
+            return
+        
+        # Rebuild the dedupe sets from the indexed metadata columns; PDF hashes were
+        # stored at ingestion time, so the uploaded files are never re-read here
+        self.url_hashes = {self._hash_url(source) for source in self.metadata.sources('url')}
+        self.pdf_hashes = self.metadata.content_hashes('pdf')
+        self._store_generation = self.store.generation
     
     def _hash_url(self, url: str) -> str:
         return hashlib.md5(url.encode()).hexdigest()
     
     def _hash_file(self, filepath: str) -> str:
         try:
+            digest = hashlib.md5()
             with open(filepath, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    digest.update(block)
+            return digest.hexdigest()
         except Exception as e:
             print(f"Error hashing file {filepath}: {e}")
             return hashlib.md5(filepath.encode()).hexdigest()
     
     def save_data_store(self):
-        faiss.write_index(self.vector_store, DATA_STORE_FILE)
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(self.metadata, f)
+        self.store.save()
+        # The hash sets are updated by the caller, so this generation is already in sync
+        self._store_generation = self.store.generation
+    
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        """Call the embedding provider, which caps the calls in flight and times them out"""
+        return self.embedder.embed(texts, input_type)
+    
+    def get_query_embedding(self, query: str) -> List[float]:
+        """Embed a search query, from the cache when the same question was asked before"""
+        model = self.embedder.model
+        embedding = self.query_cache.get(query, model)
+        if embedding is None:
+            embedding = self._embed([query], "search_query")[0]
+            self.query_cache.put(query, model, embedding)
+        return embedding
+    
+    def cached_query_embedding(self, query: str) -> Optional[List[float]]:
+        """The query's embedding if it is already cached; never calls the API"""
+        return self.query_cache.get(query, self.embedder.model)
     
-    def get_embedding(self, text: str) -> Optional[List[float]]:
+    def get_embeddings(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Embed document texts through the shared batcher; None if any batch failed"""
         try:
-            response = self.cohere_client.embed(
-                texts=[text],
-                model=EMBEDDING_MODEL,
-                input_type="search_document"
-            )
-            return response.embeddings[0]
+            return self.embedding_batcher.embed(texts)
         except Exception as e:
             print(f"Embedding error: {str(e)}")
             return None
     
+    def document_id(self, doc_type: str, source: str) -> str:
+        """Stable ID of a source document, shared by all of its chunks"""
+        return hashlib.md5(f"{doc_type}:{source}".encode()).hexdigest()
+    
+    def _chunk_document(self, pages: List[str], base_metadata: Dict, paged: bool = False) -> List[Dict]:
+        """Split a document into per-chunk metadata records that point back to the parent document"""
+        doc_id = self.document_id(base_metadata['type'], base_metadata['source'])
+        records = []
+        for page_number, page_text in enumerate(pages, start=1):
+            for offset, chunk in chunk_text(page_text):
+                record = dict(base_metadata)
+                record.update({
+                    'doc_id': doc_id,
+                    'chunk_id': f"{doc_id}:{len(records)}",
+                    'chunk_index': len(records),
+                    'page': page_number if paged else None,
+                    'offset': offset,
+                    'text': chunk
+                })
+                records.append(record)
+        return records
+    
     def extract_text_from_url(self, url: str) -> Optional[str]:
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+            response = self.crawler.fetch(url)
             
             if response.headers.get('content-type', '').startswith('application/pdf'):
-                return self.extract_text_from_pdf(BytesIO(response.content))
+                return self.extract_text_from_pdf(response.content)
             
             soup = BeautifulSoup(response.text, 'html.parser')
             for element in soup(['script', 'style', 'nav', 'footer', 'header']):
                 element.decompose()
                 
             main_content = soup.find('main') or soup.find('article') or soup.body
-            text = main_content.get_text(separator=' ', strip=True)
-            return text[:MAX_CONTEXT_LENGTH] if len(text) > MAX_CONTEXT_LENGTH else text
+            # Keep block boundaries as line breaks so chunking can split on them
+            return main_content.get_text(separator='\n', strip=True)
             
         except Exception as e:
             print(f"URL processing error: {str(e)}")
             return None
     
-    def extract_text_from_pdf(self, pdf_file) -> str:
+    def extract_pages_from_pdf(self, pdf_source: PdfSource) -> List[str]:
+        """Extract the text of every page of a PDF (path or bytes), in page order"""
         try:
-            reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-            return text[:MAX_CONTEXT_LENGTH] if len(text) > MAX_CONTEXT_LENGTH else text
+            return self.pdf_extractor.extract_pages(pdf_source)
         except Exception as e:
             print(f"PDF processing error: {str(e)}")
-            return ""
+            return []
+    
+    def extract_text_from_pdf(self, pdf_source: PdfSource) -> str:
+        return "".join(page + "\n" for page in self.extract_pages_from_pdf(pdf_source) if page)
     
-    def process_url(self, url: str) -> Dict:
-        """Process a single URL and return metadata about the processing"""
+    def process_url(self, url: str, progress: Callable[[float, str], None] = None) -> Dict:
+        """Process a single URL and return metadata about the processing.
+
+        ``progress(fraction, message)`` is called between the pipeline stages.
+        """
+        # Any worker process may run this job: catch up with what the others indexed first
+        self.initialize_vector_store()
         url_hash = self._hash_url(url)
         if url_hash in self.url_hashes:
             return {
-                "id": str(uuid.uuid4()),
+                "id": self.document_id('url', url),
                 "url": url,
                 "added_date": datetime.now().isoformat(),
                 "status": "processed",
@@ -140,44 +290,43 @@ class DataProcessor:
             }
             
         print(f"Processing URL: {url}")
+        if progress:
+            progress(0.1, "Fetching page")
         text = self.extract_text_from_url(url)
         if not text:
             return {
-                "id": str(uuid.uuid4()),
+                "id": self.document_id('url', url),
                 "url": url,
                 "added_date": datetime.now().isoformat(),
                 "status": "error",
                 "message": "Failed to extract text from URL"
             }
                 
-        embedding = None
-        for _ in range(3):
-            embedding = self.get_embedding(text)
-            if embedding is not None:
-                break
-            time.sleep(1)
-                
-        if embedding is None:
+        chunks = self._chunk_document([text], {
+            'source': url,
+            'type': 'url',
+            'added_date': datetime.now().isoformat()
+        })
+        
+        if progress:
+            progress(0.4, f"Embedding {len(chunks)} chunks")
+        embeddings = self.get_embeddings([chunk['text'] for chunk in chunks])
+        if embeddings is None:
             return {
-                "id": str(uuid.uuid4()),
+                "id": self.document_id('url', url),
                 "url": url,
                 "added_date": datetime.now().isoformat(),
                 "status": "error",
                 "message": "Failed to generate embedding"
             }
-                
-        metadata = {
-            'source': url,
-            'text': text,
-            'type': 'url',
-            'added_date': datetime.now().isoformat()
-        }
             
-        self._update_vector_store([embedding], [metadata])
+        if progress:
+            progress(0.9, "Indexing")
+        self._update_vector_store(embeddings, chunks)
         self.url_hashes.add(url_hash)
         
         return {
-            "id": str(uuid.uuid4()),
+            "id": self.document_id('url', url),
             "url": url,
             "added_date": datetime.now().isoformat(),
             "status": "processed",
@@ -187,35 +336,37 @@ class DataProcessor:
     def process_urls(self, urls: List[str]) -> List[Dict]:
         """Process multiple URLs and return metadata about each"""
         self.initialize_vector_store()
-        results = []
         
         # First identify which URLs need processing
         urls_to_process = []
-        for url in urls:
+        for url in dict.fromkeys(urls):
             url_hash = self._hash_url(url)
             if url_hash not in self.url_hashes:
                 urls_to_process.append(url)
         
         if not urls_to_process:
             print("All URLs already processed. Skipping URL processing.")
-            return [{"id": str(uuid.uuid4()), "url": url, "added_date": datetime.now().isoformat(), "status": "processed", "message": "URL already processed"} for url in urls]
+            return [{"id": self.document_id('url', url), "url": url, "added_date": datetime.now().isoformat(), "status": "processed", "message": "URL already processed"} for url in urls]
             
         print(f"Processing {len(urls_to_process)} new URLs out of {len(urls)} total URLs")
         
-        for url in urls_to_process:
-            result = self.process_url(url)
-            results.append(result)
+        # Fetch, extract, embed and insert run per URL on the crawler's pool, so the stages overlap
+        results = self.crawler.map(self.process_url, urls_to_process)
             
         return results
     
-    def process_pdf(self, pdf_path: str, original_filename: str = None) -> Dict:
-        """Process a single PDF and return metadata about the processing"""
+    def process_pdf(self, pdf_path: str, original_filename: str = None,
+                    progress: Callable[[float, str], None] = None) -> Dict:
+        """Process a single PDF and return metadata about the processing.
+
+        ``progress(fraction, message)`` is called between the pipeline stages.
+        """
         self.initialize_vector_store()
         
         file_hash = self._hash_file(pdf_path)
         if file_hash in self.pdf_hashes:
             return {
-                "id": str(uuid.uuid4()),
+                "id": self.document_id('pdf', pdf_path),
                 "filename": original_filename or pdf_path,
                 "added_date": datetime.now().isoformat(),
                 "status": "processed",
@@ -225,58 +376,67 @@ class DataProcessor:
             
         print(f"Processing PDF: {pdf_path}")
         try:
-            with open(pdf_path, 'rb') as f:
-                text = self.extract_text_from_pdf(f)
-                if not text:
-                    return {
-                        "id": str(uuid.uuid4()),
-                        "filename": original_filename or pdf_path,
-                        "added_date": datetime.now().isoformat(),
-                        "status": "error",
-                        "message": "Failed to extract text from PDF",
-                        "size": os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0
-                    }
-                
-                embedding = None
-                for _ in range(3):
-                    embedding = self.get_embedding(text)
-                    if embedding is not None:
-                        break
-                    time.sleep(1)
-                    
-                if embedding is None:
-                    return {
-                        "id": str(uuid.uuid4()),
-                        "filename": original_filename or pdf_path,
-                        "added_date": datetime.now().isoformat(),
-                        "status": "error",
-                        "message": "Failed to generate embedding",
-                        "size": os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0
-                    }
-                
-                metadata = {
-                    'source': pdf_path,
-                    'text': text,
-                    'type': 'pdf',
-                    'added_date': datetime.now().isoformat(),
-                    'original_filename': original_filename or pdf_path
+            if progress:
+                progress(0.1, "Extracting text")
+            report = None
+            if progress:
+                def report(done: int, total: int):
+                    progress(0.1 + 0.3 * done / max(total, 1), f"Extracted {done}/{total} pages")
+            # Extraction runs in the PDF process pool; its errors (timeout, memory cap) end up below
+            pages = self.pdf_extractor.extract_pages(pdf_path, report)
+            if not any(page.strip() for page in pages):
+                return {
+                    "id": self.document_id('pdf', pdf_path),
+                    "filename": original_filename or pdf_path,
+                    "added_date": datetime.now().isoformat(),
+                    "status": "error",
+                    "message": "Failed to extract text from PDF",
+                    "size": os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0
                 }
-                
-                self._update_vector_store([embedding], [metadata])
-                self.pdf_hashes.add(file_hash)
-                
+            
+            chunks = self._chunk_document(pages, {
+                'source': pdf_path,
+                'type': 'pdf',
+                'added_date': datetime.now().isoformat(),
+                'original_filename': original_filename or pdf_path,
+                'content_hash': file_hash
+            }, paged=True)
+            
+            if progress:
+                progress(0.4, f"Embedding {len(chunks)} chunks")
+            embeddings = self.get_embeddings([chunk['text'] for chunk in chunks])
+            if embeddings is None:
                 return {
-                    "id": str(uuid.uuid4()),
+                    "id": self.document_id('pdf', pdf_path),
                     "filename": original_filename or pdf_path,
                     "added_date": datetime.now().isoformat(),
-                    "status": "processed",
-                    "message": "PDF processed successfully",
+                    "status": "error",
+                    "message": "Failed to generate embedding",
                     "size": os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0
                 }
+            
+            if progress:
+                progress(0.9, "Indexing")
+            # A changed file uploaded under the same name replaces the previous version's chunks
+            stale = self.metadata.vector_ids('pdf', pdf_path)
+            if stale:
+                self.store.delete(stale)
+                self._documents_changed({self.document_id('pdf', pdf_path)})
+            self._update_vector_store(embeddings, chunks)
+            self.pdf_hashes.add(file_hash)
+            
+            return {
+                "id": self.document_id('pdf', pdf_path),
+                "filename": original_filename or pdf_path,
+                "added_date": datetime.now().isoformat(),
+                "status": "processed",
+                "message": "PDF processed successfully",
+                "size": os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0
+            }
         except Exception as e:
             print(f"Error processing PDF: {str(e)}")
             return {
-                "id": str(uuid.uuid4()),
+                "id": self.document_id('pdf', pdf_path),
                 "filename": original_filename or pdf_path,
                 "added_date": datetime.now().isoformat(),
                 "status": "error",
@@ -285,101 +445,246 @@ class DataProcessor:
             }
     
     def _update_vector_store(self, new_embeddings: list, new_metadata: list):
-        new_embeddings_np = np.array(new_embeddings).astype('float32')
-        
-        if self.vector_store.ntotal == 0:
-            self.vector_store.add(new_embeddings_np)
-            self.metadata.extend(new_metadata)
-        else:
-            existing_embeddings = self.vector_store.reconstruct_n(0, self.vector_store.ntotal)
-            combined_embeddings = np.vstack([existing_embeddings, new_embeddings_np])
-            
-            self.vector_store = faiss.IndexFlatL2(EMBEDDING_DIM)
-            self.vector_store.add(combined_embeddings)
-            self.metadata.extend(new_metadata)
+        """Append new vectors to the live index; the store logs them instead of rewriting everything"""
+        generation = self.store.generation
+        self.store.add(new_embeddings, new_metadata)
+        self._documents_changed({item['doc_id'] for item in new_metadata})
         
-        self.save_data_store()
+        # Only our own insert happened, so the hash sets (updated by the caller) are still in sync
+        if self._store_generation == generation and self.store.generation == generation + 1:
+            self._store_generation = self.store.generation
+    
+    def _listing_id(self, item: Dict) -> str:
+        """Stable API ID of the document a chunk belongs to"""
+        return item.get('doc_id') or self.document_id(item['type'], item['source'])
+    
+    def delete_document(self, doc_id: str) -> bool:
+        """Remove every chunk of a document from the index and the metadata store"""
+        self.initialize_vector_store()
+        for doc_type in ('url', 'pdf'):
+            for item in self.metadata.documents(doc_type):
+                if self._listing_id(item) == doc_id:
+                    self.store.delete(self.metadata.vector_ids(doc_type, item['source']))
+                    self._documents_changed({doc_id})
+                    # Rebuild the dedupe sets so the document can be ingested again
+                    self.initialize_vector_store()
+                    return True
+        return False
+    
+    def _documents_changed(self, doc_ids: set):
+        for listener in self.document_listeners:
+            listener(doc_ids)
     
     def get_all_urls(self) -> List[Dict]:
         """Get all URLs in the knowledge base"""
         self.initialize_vector_store()
         urls = []
-        for item in self.metadata:
-            if item['type'] == 'url':
-                urls.append({
-                    "id": str(uuid.uuid4()),  # Generate a new ID for the API
-                    "url": item['source'],
-                    "added_date": item.get('added_date', datetime.now().isoformat()),
-                    "status": "processed"
-                })
+        # Documents are stored as several chunks; list each source once
+        for item in self.metadata.documents('url'):
+            urls.append({
+                "id": self._listing_id(item),
+                "url": item['source'],
+                "added_date": item.get('added_date', datetime.now().isoformat()),
+                "status": "processed"
+            })
         return urls
     
     def get_all_pdfs(self) -> List[Dict]:
         """Get all PDFs in the knowledge base"""
         self.initialize_vector_store()
         pdfs = []
-        for item in self.metadata:
-            if item['type'] == 'pdf':
-                pdfs.append({
-                    "id": str(uuid.uuid4()),  # Generate a new ID for the API
-                    "filename": item.get('original_filename', item['source']),
-                    "added_date": item.get('added_date', datetime.now().isoformat()),
-                    "status": "processed",
-                    "size": os.path.getsize(item['source']) if os.path.exists(item['source']) else 0
-                })
+        for item in self.metadata.documents('pdf'):
+            pdfs.append({
+                "id": self._listing_id(item),
+                "filename": item.get('original_filename', item['source']),
+                "added_date": item.get('added_date', datetime.now().isoformat()),
+                "status": "processed",
+                "size": os.path.getsize(item['source']) if os.path.exists(item['source']) else 0
+            })
         return pdfs
     
-    def get_vector_db_size(self) -> int:
-        """Get the size of the vector database"""
+    def get_vector_db_size(self, refresh: bool = True) -> int:
+        """Get the size of the vector database; ``refresh=False`` reports the loaded index without touching disk"""
+        if refresh:
+            self.initialize_vector_store()
+        return self.store.ntotal
+    
+    def get_index_memory_stats(self) -> Dict:
+        """Get the index type and its resident memory per vector"""
         self.initialize_vector_store()
-        return self.vector_store.ntotal
+        return self.store.memory_stats()
+    
+    def get_rerank_stats(self) -> Dict:
+        return {
+            'reranker': self.reranker.name,
+            'min_score': self.reranker.min_score,
+            'queries_below_cutoff': self.queries_below_cutoff
+        }
+    
+    def get_embedding_stats(self) -> Dict:
+        """Get the request and text counters of the document embedding batcher"""
+        return self.embedding_batcher.stats()
+    
+    def get_query_cache_stats(self) -> Dict:
+        """Get hit-rate counters of the query embedding cache"""
+        return self.query_cache.stats()
     
     def search_relevant_documents(self, query: str, k: int = 3) -> List[Dict]:
-        """Search for relevant documents given a query"""
+        """Search for relevant documents given a query.
+
+        Over-fetches RERANK_CANDIDATES, rescores them with the reranker and
+        returns the best ``k`` above its cutoff; an empty list means nothing
+        in the knowledge base is relevant.
+        """
         self.initialize_vector_store()
         
-        if self.vector_store.ntotal == 0:
+        if self.store.ntotal == 0:
             return []
         
+        reranker = self.reranker
+        fetch = k if reranker.name == "none" else max(k, RERANK_CANDIDATES)
+        candidates, query_embedding = self._retrieve(query, fetch)
+        docs = reranker.relevant(reranker.rerank(query, query_embedding, candidates))[:k]
+        if candidates and not docs:
+            self.queries_below_cutoff += 1
+            print(f"No passage scored above {reranker.min_score} ({reranker.name}) for: {query[:80]}")
+        return docs
+    
+    def _retrieve(self, query: str, k: int) -> tuple:
+        """Return the top ``k`` candidates and the query embedding (None if it was unavailable)"""
+        if not HYBRID_SEARCH:
+            try:
+                query_embedding = self.get_query_embedding(query)
+            except Exception as e:
+                print(f"Query embedding error: {str(e)}")
+                return [], None
+            
+            query_embedding_np = np.array([query_embedding]).astype('float32')
+            return self.store.search(query_embedding_np, k), query_embedding
+        
+        fetch = max(k, HYBRID_CANDIDATES)
+        # Keyword search runs alongside the embedding and the dense search, under its own time budget
+        lexical = self.lexical_executor.submit(self.metadata.lexical_search, query, fetch)
+        embedding = self.query_executor.submit(self.get_query_embedding, query)
         try:
-            response = self.cohere_client.embed(
-                texts=[query],
-                model=EMBEDDING_MODEL,
-                input_type="search_query"
-            )
-            query_embedding = response.embeddings[0]
+            query_embedding = embedding.result(timeout=QUERY_EMBED_TIMEOUT)
         except Exception as e:
-            print(f"Query embedding error: {str(e)}")
-            return []
+            # Slow or failing embedding API: keyword results alone still answer the question
+            print(f"Query embedding unavailable ({e!r}), using keyword search only")
+            return self._fuse([], lexical.result(), k), None
         
-        query_embedding_np = np.array([query_embedding]).astype('float32')
-        distances, indices = self.vector_store.search(query_embedding_np, k)
+        dense = self.store.search(np.array([query_embedding]).astype('float32'), fetch)
+        return self._fuse(dense, lexical.result(), k), query_embedding
+    
+    def _fuse(self, dense: List[Dict], lexical: List[tuple], k: int) -> List[Dict]:
+        """Merge dense results and (vector ID, BM25 score) pairs by reciprocal-rank fusion"""
+        scores = {}
+        records = {}
+        for rank, doc in enumerate(dense):
+            scores[doc['vector_id']] = 1.0 / (RRF_K + rank + 1)
+            records[doc['vector_id']] = doc
+        lexical_scores = dict(lexical)
+        for rank, (vector_id, _) in enumerate(lexical):
+            scores[vector_id] = scores.get(vector_id, 0.0) + 1.0 / (RRF_K + rank + 1)
         
-        results = []
-        for idx, distance in zip(indices[0], distances[0]):
-            if idx < len(self.metadata):
-                result = self.metadata[idx].copy()
-                result['distance'] = float(distance)
-                results.append(result)
+        top = sorted(scores, key=scores.get, reverse=True)[:k]
+        # Text of keyword-only hits is read just for the ones that made the cut
+        for vector_id, record in self.metadata.get(v for v in top if v not in records).items():
+            record['vector_id'] = vector_id
+            records[vector_id] = record
         
+        results = []
+        for vector_id in top:
+            if vector_id in records:
+                doc = records[vector_id]
+                doc['fused_score'] = scores[vector_id]
+                if vector_id in lexical_scores:
+                    doc['lexical_score'] = lexical_scores[vector_id]
+                results.append(doc)
         return results
 
 
-class Chatbot:
+class StreamingResponseCleaner:
+    """Incrementally apply the clean-up generate_response does on a finished answer.
+
+    Text inside a leading <think>...</think> block is dropped, markdown
+    emphasis markers are removed, and leading whitespace is trimmed. Just
+    enough text is held back to make those decisions across chunk borders.
+    """
+
     def __init__(self):
-        # Initialize with environment variables if available
-        self.groq_api_key = GROQ_API_KEY
-        self.llm_model = "qwen-qwq-32b"
+        self.buffer = ""
+        self.in_preamble = True  # Still deciding whether the answer opens with <think>
+        self.in_think = False
+        self.started = False
+
+    def feed(self, text: str) -> str:
+        """Add streamed text and return whatever is now safe to emit"""
+        self.buffer += text
+        
+        if self.in_preamble:
+            head = self.buffer.lstrip().lower()
+            if head.startswith('<think>'):
+                self.in_think = True
+            elif len(head) < len('<think>') and '<think>'.startswith(head):
+                return ""  # Could still turn into <think>
+            self.in_preamble = False
+        
+        if self.in_think:
+            end = self.buffer.lower().find('</think>')
+            if end == -1:
+                return ""
+            self.buffer = self.buffer[end + len('</think>'):]
+            self.in_think = False
+        
+        # Hold back trailing whitespace (the finished answer is stripped) and an
+        # unpaired trailing "*" that may be the first half of "**"
+        text = self.buffer.rstrip()
+        stars = len(text) - len(text.rstrip('*'))
+        if stars % 2:
+            text = text[:-1]
+        self.buffer = self.buffer[len(text):]
+        return self._clean(text)
+
+    def finish(self) -> str:
+        """Flush what is left once the stream has ended"""
+        if self.in_think:
+            return ""
+        text, self.buffer = self.buffer, ""
+        return self._clean(text).rstrip()
+
+    def _clean(self, text: str) -> str:
+        text = text.replace('**', '').replace('__', '').replace('_', '')
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+
+class Chatbot:
+    def __init__(self, data_processor: DataProcessor = None, llm: CompletionProvider = None):
+        # LLM provider (LLM_PROVIDER): Groq, or a canned local model for offline runs
+        self.llm = llm or make_completion_provider(api_key=GROQ_API_KEY)
         self.max_context = 4000
+        self.context_tokens = None  # Token budget for retrieved context; derived from max_context if unset
         self.bot_name = "Company Assistant"
         self.greeting = "Hello! How can I help you with information about our company?"
         self.debug_mode = False
         
-        # Initialize data processor
-        self.data_processor = DataProcessor()
+        # Share the API's data processor so there is a single copy of the knowledge base
+        self.data_processor = data_processor or DataProcessor()
+        
+        # Blocking chat work runs here so it never stalls the event loop
+        self.executor = ThreadPoolExecutor(max_workers=CHAT_WORKERS, thread_name_prefix="chat")
+        
+        # Retrieved passages are deduplicated and packed into the token budget
+        self.context_packer = ContextPacker()
+        self.context_tokens_used = 0
+        self.contexts_packed = 0
         
-        # Initialize Groq client
-        self.groq_client = Groq(api_key=self.groq_api_key)
+        # Answers to paraphrased questions over the same documents are reused
+        self.answer_cache = SemanticAnswerCache()
+        self.data_processor.document_listeners.append(self.answer_cache.invalidate_documents)
         
         # Greetings dictionary
         self.greetings = {
@@ -391,39 +696,47 @@ class Chatbot:
             "good evening": "Good evening! How can I help you with information about our company today?"
         }
         
-        # Chat memory
-        self.memory = []
-        self.memory_file = "chatbot_memory.json"
-        self.load_memory()
+        # Chat memory: recent exchanges in RAM, everything in a log written in the background
+        self.conversation_log = ConversationLog()
+        self.conversation_log.migrate_json("chatbot_memory.json")
     
-    def load_memory(self):
-        """Load the chat memory from a file"""
-        try:
-            if os.path.exists(self.memory_file):
-                with open(self.memory_file, 'r') as f:
-                    self.memory = json.load(f)
-        except Exception as e:
-            print(f"Error loading memory: {e}")
-            self.memory = []
+    @property
+    def llm_model(self) -> str:
+        return self.llm.model
+    
+    @llm_model.setter
+    def llm_model(self, model: str):
+        self.llm.model = model
+    
+    @property
+    def memory(self) -> List[Dict]:
+        """The most recent exchanges, oldest first"""
+        return self.conversation_log.history()
     
     def save_memory(self):
-        """Save the chat memory to a file"""
-        try:
-            with open(self.memory_file, 'w') as f:
-                json.dump(self.memory, f)
-        except Exception as e:
-            print(f"Error saving memory: {e}")
+        """Wait until the chat memory is written to disk"""
+        self.conversation_log.flush()
+    
+    def _remember(self, query: str, response: str):
+        """Add an exchange to the chat memory; the log is written off the request path"""
+        self.conversation_log.append(query, response)
     
     def update_api_keys(self, groq_api_key: str):
         """Update the Groq API key"""
-        self.groq_api_key = groq_api_key
-        self.groq_client = Groq(api_key=self.groq_api_key)
+        self.llm.set_api_key(groq_api_key)
     
-    def update_settings(self, llm_model: str, max_context: int, bot_name: str = None, greeting: str = None, debug_mode: bool = None):
+    def update_settings(self, llm_model: str, max_context: int, bot_name: str = None, greeting: str = None, debug_mode: bool = None,
+                        answer_cache_threshold: float = None, context_tokens: int = None):
         """Update the LLM model and max context settings"""
         self.llm_model = llm_model
         self.max_context = max_context
         
+        if context_tokens is not None:
+            self.context_tokens = context_tokens or None  # 0 goes back to the budget derived from max_context
+        
+        if answer_cache_threshold is not None:
+            self.answer_cache.threshold = answer_cache_threshold
+        
         if bot_name is not None:
             self.bot_name = bot_name
             # Update greetings with new bot name
@@ -448,6 +761,72 @@ class Chatbot:
         query_lower = query.lower().strip()
         return self.greetings.get(query_lower, self.greeting)
     
+    def _no_results_response(self) -> str:
+        return f"I couldn't find relevant information to answer your question. Please try asking about something else related to {self.bot_name}."
+    
+    @property
+    def context_budget(self) -> int:
+        """Tokens of retrieved context allowed in a prompt"""
+        return self.context_tokens or max(1, self.max_context // CHARS_PER_TOKEN)
+    
+    def _pack_context(self, relevant_docs: List[Dict]) -> Dict:
+        """Pack the retrieved documents into the context budget and record the tokens used"""
+        packed = self.context_packer.pack(relevant_docs, self.context_budget)
+        self.context_tokens_used += packed['tokens']
+        self.contexts_packed += 1
+        return packed
+    
+    def get_context_stats(self) -> Dict:
+        return {
+            'budget': self.context_budget,
+            'avg_tokens': round(self.context_tokens_used / self.contexts_packed, 1) if self.contexts_packed else 0.0,
+            'exact_tokenizer': self.context_packer.counter.exact
+        }
+    
+    def _build_messages(self, query: str, context: str) -> List[Dict]:
+        """Build the Groq chat messages for a query and its packed context"""
+        # Prepare prompt with proper Python string formatting
+        prompt = f"""You are a helpful assistant for {self.bot_name}. 
+        Answer based strictly on this context. If the answer isn't here, say:
+        "I don't have that information in my knowledge base. Please contact us at Email: info@manipaltechnologies.com or Phone: +91 820 2205000  for more details."
+
+        Important: 
+        - Provide only the direct answer without any thinking process or analysis
+        - Remove any markdown formatting like **, _, etc.
+        - Do not include any text like <Thinking> or reasoning before the answer
+        - Just provide the clean, factual answer directly
+
+        Context: {context}
+
+        Question: {query}
+
+        Answer:"""
+        
+        return [
+            {"role": "system", "content": f"You are a helpful assistant for {self.bot_name}."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _answer_settings(self) -> tuple:
+        """Settings that change what the LLM answers, so cached answers are kept apart per value"""
+        return (self.llm_model, self.bot_name, self.context_budget)
+    
+    def _cached_answer(self, query: str, relevant_docs: List[Dict]):
+        """Return (query embedding, cached answer or None) for a query and its retrieved documents"""
+        # Embedded (and cached) by the search; missing when retrieval fell back to keywords only
+        query_embedding = self.data_processor.cached_query_embedding(query)
+        if query_embedding is None:
+            return None, None
+        return query_embedding, self.answer_cache.get(query_embedding, relevant_docs, self._answer_settings())
+    
+    def _debug_info(self, relevant_docs: List[Dict], packed: Dict = None) -> str:
+        debug_info = "\n\n---\nDebug Info:\n"
+        debug_info += f"Model: {self.llm_model}\n"
+        debug_info += f"Sources: {', '.join([doc.get('source', 'Unknown') for doc in relevant_docs])}\n"
+        if packed is not None:
+            debug_info += f"Context tokens: {packed['tokens']}/{packed['budget']} from {len(packed['docs'])} chunks\n"
+        return debug_info
+    
     def generate_response(self, query: str) -> str:
         """Generate a response to a query using RAG"""
         # Check for greetings first
@@ -455,12 +834,7 @@ class Chatbot:
             response = self.handle_greeting(query)
             
             # Add to memory
-            self.memory.append({
-                "query": query,
-                "response": response,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.save_memory()
+            self._remember(query, response)
             
             return response
         
@@ -469,77 +843,40 @@ class Chatbot:
             relevant_docs = self.data_processor.search_relevant_documents(query)
             
             if not relevant_docs:
-                response = f"I couldn't find relevant information to answer your question. Please try asking about something else related to {self.bot_name}."
+                response = self._no_results_response()
                 
                 # Add to memory
-                self.memory.append({
-                    "query": query,
-                    "response": response,
-                    "timestamp": datetime.now().isoformat()
-                })
-                self.save_memory()
+                self._remember(query, response)
                 
                 return response
             
-            # Prepare context
-            context = "\n\n".join([doc['text'] for doc in relevant_docs])
+            query_embedding, cached = self._cached_answer(query, relevant_docs)
+            if cached is not None:
+                response = cached + (self._debug_info(relevant_docs) if self.debug_mode else "")
+                self._remember(query, response)
+                return response
             
-            # Truncate context if too long
-            if len(context) > self.max_context:
-                context = context[:self.max_context]
+            # Generate response using the LLM provider
+            packed = self._pack_context(relevant_docs)
+            response = self.llm.complete(self._build_messages(query, packed['text']), temperature=0.3, max_tokens=500)
             
-            # Prepare prompt with proper Python string formatting
-            prompt = f"""You are a helpful assistant for {self.bot_name}. 
-            Answer based strictly on this context. If the answer isn't here, say:
-            "I don't have that information in my knowledge base. Please contact us at Email: info@manipaltechnologies.com or Phone: +91 820 2205000  for more details."
-
-            Important: 
-            - Provide only the direct answer without any thinking process or analysis
-            - Remove any markdown formatting like **, _, etc.
-            - Do not include any text like <Thinking> or reasoning before the answer
-            - Just provide the clean, factual answer directly
-
-            Context: {context}
-
-            Question: {query}
-
-            Answer:"""
-            
-            # Generate response using Groq
-            chat_completion = self.groq_client.chat.completions.create(
-                model=self.llm_model,
-                messages=[
-                    {"role": "system", "content": f"You are a helpful assistant for {self.bot_name}."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=500
-            )
-            
-            # Get the raw response and clean it
-            response = chat_completion.choices[0].message.content.strip()
+            # Clean the raw response
+            response = response.strip()
             
             # Remove any thinking patterns if they somehow still appear
             if '<think>' in response.lower():
                 response = response.split('</think>')[-1].strip()
             # Remove markdown formatting
             response = response.replace('**', '').replace('__', '').replace('_', '')
-            
+            if query_embedding is not None and response:
+                self.answer_cache.put(query_embedding, relevant_docs, self._answer_settings(), response)
             
             # Add debug information if debug mode is enabled
             if self.debug_mode:
-                debug_info = "\n\n---\nDebug Info:\n"
-                debug_info += f"Model: {self.llm_model}\n"
-                debug_info += f"Sources: {', '.join([doc.get('source', 'Unknown') for doc in relevant_docs])}\n"
-                response += debug_info
+                response += self._debug_info(relevant_docs, packed)
             
             # Add to memory
-            self.memory.append({
-                "query": query,
-                "response": response,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.save_memory()
+            self._remember(query, response)
             
             return response
             
@@ -548,11 +885,65 @@ class Chatbot:
             response = f"I'm sorry, I encountered an error: {str(e)}"
             
             # Add to memory
-            self.memory.append({
-                "query": query,
-                "response": response,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.save_memory()
+            self._remember(query, response)
             
             return response
+    
+    def stream_response(self, query: str) -> Iterator[str]:
+        """Generate a response to a query using RAG, yielding cleaned text as Groq produces it"""
+        if self.is_greeting(query):
+            response = self.handle_greeting(query)
+            self._remember(query, response)
+            yield response
+            return
+        
+        parts = []
+        try:
+            relevant_docs = self.data_processor.search_relevant_documents(query)
+            
+            if not relevant_docs:
+                response = self._no_results_response()
+                self._remember(query, response)
+                yield response
+                return
+            
+            query_embedding, cached = self._cached_answer(query, relevant_docs)
+            if cached is not None:
+                response = cached + (self._debug_info(relevant_docs) if self.debug_mode else "")
+                self._remember(query, response)
+                yield response
+                return
+            
+            cleaner = StreamingResponseCleaner()
+            packed = self._pack_context(relevant_docs)
+            for piece in self.llm.stream(self._build_messages(query, packed['text']), temperature=0.3, max_tokens=500):
+                text = cleaner.feed(piece)
+                if text:
+                    parts.append(text)
+                    yield text
+            
+            text = cleaner.finish()
+            answer = "".join(parts) + text
+            if not answer.strip():
+                # Nothing came out of the cleaner, e.g. the model ran out of tokens inside <think>
+                text = self._no_results_response()
+            elif query_embedding is not None:
+                self.answer_cache.put(query_embedding, relevant_docs, self._answer_settings(), answer)
+            if self.debug_mode:
+                text += self._debug_info(relevant_docs, packed)
+            if text:
+                parts.append(text)
+                yield text
+            
+            self._remember(query, "".join(parts))
+            
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            response = f"I'm sorry, I encountered an error: {str(e)}"
+            self._remember(query, "".join(parts) + response)
+            yield response
+    
+    async def agenerate_response(self, query: str) -> str:
+        """Generate a response without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.generate_response, query)
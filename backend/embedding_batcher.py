@@ -0,0 +1,110 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+# Configuration
+EMBED_BATCH_SIZE = 96  # Cohere's per-request limit
+EMBED_MAX_IN_FLIGHT = int(os.environ.get("EMBED_MAX_IN_FLIGHT", "4"))
+EMBED_LINGER_SECONDS = float(os.environ.get("EMBED_LINGER_SECONDS", "0.05"))
+
+class EmbeddingBatcher:
+    """Coalesce embedding requests from concurrent ingestion jobs into provider-sized batches.
+
+    Callers submit texts and get one future per text. A dispatcher thread
+    packs pending texts into requests of up to ``batch_size`` texts, waiting
+    at most ``linger`` seconds for a batch to fill, and keeps at most
+    ``max_in_flight`` requests running. The pending queue is bounded, so
+    producers block instead of piling up work when the provider falls behind.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]],
+                 batch_size: int = EMBED_BATCH_SIZE, max_in_flight: int = EMBED_MAX_IN_FLIGHT,
+                 linger: float = EMBED_LINGER_SECONDS, retries: int = 3):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.linger = linger
+        self.retries = retries
+
+        self._pending = queue.Queue(maxsize=batch_size * max_in_flight * 4)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed")
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+
+        # Counters for monitoring, updated from the embedding threads
+        self.requests_sent = 0
+        self.texts_embedded = 0
+        self._stats_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._run, name="embed-dispatcher", daemon=True)
+                self._dispatcher.start()
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        """Queue texts for embedding; returns one future per text, in order"""
+        self._ensure_started()
+        futures = []
+        for text in texts:
+            future = Future()
+            self._pending.put((text, future))
+            futures.append(future)
+        return futures
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts and wait for the results; raises if any batch ultimately failed"""
+        return [future.result() for future in self.submit(texts)]
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._pending.get(timeout=remaining)
+                    else:
+                        item = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._in_flight.acquire()
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: list):
+        try:
+            texts = [text for text, _ in batch]
+            for attempt in range(self.retries):
+                try:
+                    embeddings = self.embed_fn(texts)
+                    if len(embeddings) != len(texts):
+                        # Unmatched futures would never resolve: fail (or retry) the whole batch
+                        raise ValueError(f"Provider returned {len(embeddings)} embeddings for {len(texts)} texts")
+                    break
+                except Exception as e:
+                    print(f"Embedding batch error: {str(e)}")
+                    if attempt == self.retries - 1:
+                        for _, future in batch:
+                            future.set_exception(e)
+                        return
+                    time.sleep(2 ** attempt)
+            with self._stats_lock:
+                self.requests_sent += 1
+                self.texts_embedded += len(texts)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+        finally:
+            self._in_flight.release()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                'requests': self.requests_sent,
+                'texts': self.texts_embedded,
+                'avg_batch': round(self.texts_embedded / self.requests_sent, 1) if self.requests_sent else 0.0
+            }
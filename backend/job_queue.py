@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# Configuration
+JOBS_DB_FILE = "jobs.db"
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))  # Per API worker process
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", "5"))  # Doubled after every failed attempt
+JOB_POLL_INTERVAL = 1.0  # Picks up jobs queued by other processes
+JOB_HEARTBEAT_INTERVAL = 10.0
+JOB_STALE_AFTER = 6 * JOB_HEARTBEAT_INTERVAL  # Running jobs without a heartbeat this long are requeued
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    owner TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, run_after, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key, status);
+"""
+
+class JobCancelled(BaseException):
+    """Raised inside a job when cancellation was requested.
+
+    Like asyncio.CancelledError it is not an Exception, so the broad error
+    handling in the ingestion pipeline does not swallow it.
+    """
+
+class JobContext:
+    """Handed to a running job so it can report progress and notice cancellation"""
+
+    def __init__(self, queue: 'JobQueue', job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    def progress(self, fraction: float, message: str = None):
+        """Record progress (0..1); raises JobCancelled if the job was cancelled meanwhile"""
+        if self.queue._update_progress(self.job_id, fraction, message):
+            raise JobCancelled()
+
+class JobQueue:
+    """Durable ingestion job queue in SQLite, run by a pool of worker threads.
+
+    Jobs survive restarts. Every API worker process runs ``workers``
+    threads that claim queued jobs atomically, so jobs are spread over all
+    processes. Running jobs send heartbeats; a job whose heartbeat stops
+    (its process died) is queued again, or failed if that was its last
+    attempt. A job that raises is retried after an exponential backoff
+    until ``max_attempts`` is used up. Queued jobs can be cancelled
+    outright; running jobs stop at their next progress report.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_FILE, workers: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_delay: float = JOB_RETRY_DELAY):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._handlers: Dict[str, Callable] = {}
+        self._failure_handlers: Dict[str, Callable] = {}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._running: set = set()  # IDs of jobs this process is running
+        self._running_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def register(self, kind: str, handler: Callable[[Dict, JobContext], Any],
+                 on_failure: Callable[[Dict, str], None] = None):
+        """Run ``handler(payload, context)`` for jobs of this kind; ``on_failure`` once retries are used up"""
+        self._handlers[kind] = handler
+        if on_failure is not None:
+            self._failure_handlers[kind] = on_failure
+
+    def start(self):
+        """Requeue jobs orphaned by a dead process and start the worker threads"""
+        if self._threads:
+            return
+        self._requeue_stale()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, kind: str, payload: Dict, dedupe_key: str = None) -> Dict:
+        """Queue a job; an unfinished job with the same ``dedupe_key`` is returned instead of a new one"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE dedupe_key = ? AND status IN (?, ?)",
+                    (dedupe_key, QUEUED, RUNNING)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return self._job(row)
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, dedupe_key, payload, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, dedupe_key, json.dumps(payload), QUEUED, now, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def list(self, status: str = None, limit: int = 100) -> List[Dict]:
+        if status:
+            rows = self._connect().execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a queued job now, or ask a running one to stop; returns the job, or None if unknown"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = ?, message = 'Cancelled', updated_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, now, job_id, QUEUED)
+        )
+        conn.execute(
+            "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = ?",
+            (now, job_id, RUNNING)
+        )
+        return self.get(job_id)
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Dict:
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"],
+            "cancelRequested": bool(row["cancel_requested"]),
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"]
+        }
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Atomically move the oldest runnable job to running and return it"""
+        now = time.time()
+        conn = self._connect()
+        # One IMMEDIATE transaction instead of UPDATE ... RETURNING, which needs SQLite 3.35+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY created_at LIMIT 1",
+                (QUEUED, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, heartbeat_at = ?, updated_at = ? "
+                "WHERE id = ?",
+                (RUNNING, self.owner, now, now, row["id"])
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _work(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                row = None
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run(row)
+
+    def _run(self, row: sqlite3.Row):
+        job_id, kind = row["id"], row["kind"]
+        payload = json.loads(row["payload"])
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler for job kind: {kind}")
+            if row["cancel_requested"]:
+                raise JobCancelled()
+            result = handler(payload, JobContext(self, job_id))
+            self._finish(job_id, SUCCEEDED, "Done", result)
+        except JobCancelled:
+            self._finish(job_id, CANCELLED, "Cancelled")
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) attempt {row['attempts']} failed: {e}")
+            if row["attempts"] < self.max_attempts:
+                delay = self.retry_delay * 2 ** (row["attempts"] - 1)
+                self._connect().execute(
+                    "UPDATE jobs SET status = ?, message = ?, run_after = ?, owner = NULL, updated_at = ? "
+                    "WHERE id = ?",
+                    (QUEUED, f"Retrying after error: {e}", time.time() + delay, time.time(), job_id)
+                )
+            else:
+                self._finish(job_id, FAILED, str(e))
+                self._on_failure(kind, payload, str(e))
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
+
+    def _on_failure(self, kind: str, payload: Dict, message: str):
+        on_failure = self._failure_handlers.get(kind)
+        if on_failure is not None:
+            try:
+                on_failure(payload, message)
+            except Exception as hook_error:
+                print(f"Job failure handler error: {hook_error}")
+
+    def _finish(self, job_id: str, status: str, message: str, result: Any = None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, message = ?, result = ?, progress = CASE WHEN ? THEN 1 ELSE progress END, "
+            "owner = NULL, updated_at = ? WHERE id = ?",
+            (status, message, json.dumps(result) if result is not None else None,
+             status == SUCCEEDED, time.time(), job_id)
+        )
+
+    def _update_progress(self, job_id: str, fraction: float, message: str = None) -> bool:
+        """Store progress and refresh the heartbeat; returns whether cancellation was requested"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat_at = ?, updated_at = ? "
+            "WHERE id = ?",
+            (max(0.0, min(1.0, fraction)), message, now, now, job_id)
+        )
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+            with self._running_lock:
+                running = list(self._running)
+            try:
+                if running:
+                    placeholders = ",".join("?" * len(running))
+                    self._connect().execute(
+                        f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({placeholders})",
+                        (time.time(), *running)
+                    )
+                self._requeue_stale()
+            except sqlite3.Error as e:
+                print(f"Job heartbeat error: {e}")
+
+    def _requeue_stale(self):
+        """Put running jobs whose process stopped sending heartbeats back in the queue.
+
+        A job that already used up its attempts fails instead: if the job is
+        what killed its process (out of memory, a crash in a parser),
+        requeueing it would take down every worker that claims it in turn.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE status = ? AND heartbeat_at < ?",
+                (RUNNING, now - JOB_STALE_AFTER)
+            ).fetchall()
+            exhausted = [row for row in rows if row["attempts"] >= self.max_attempts]
+            for row in rows:
+                if row["attempts"] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, owner = NULL, message = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, f"Worker stopped during attempt {row['attempts']}", now, row["id"])
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, owner = NULL, message = 'Requeued after worker restart', "
+                        "updated_at = ? WHERE id = ?",
+                        (QUEUED, now, row["id"])
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if len(rows) > len(exhausted):
+            print(f"Requeued {len(rows) - len(exhausted)} interrupted jobs")
+        for row in exhausted:
+            print(f"Job {row['id']} ({row['kind']}) failed: its worker stopped on the last attempt")
+            self._on_failure(row["kind"], json.loads(row["payload"]), f"Worker stopped during attempt {row['attempts']}")
@@ -1,5 +1,7 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, BackgroundTasks, Cookie, Header, Request, Response, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Cookie, Header, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 import uvicorn
@@ -11,7 +13,16 @@ import uuid
 import shutil
 import secrets
 import base64
+import hashlib
+import threading
 from data_processor import DataProcessor, Chatbot
+from job_queue import JobQueue, SUCCEEDED, FAILED, CANCELLED
+from reranker import RERANKERS
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, every worker seeds on its own
+    fcntl = None
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -45,9 +56,13 @@ async def options_handler(request: Request, path: str):
         }
     )
 
-# Initialize the data processor and chatbot
-data_processor = DataProcessor()
-chatbot = Chatbot()
+# The data processor and chatbot (sharing one knowledge base) and the job queue are created
+# by init_services() at startup, not at import: PDF extraction workers are spawned processes
+# that import this module again (as __mp_main__ under `python main.py`) and must not load the
+# index, migrate the databases or start their own job workers
+data_processor: Optional[DataProcessor] = None
+chatbot: Optional[Chatbot] = None
+job_queue: Optional[JobQueue] = None
 
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
@@ -71,6 +86,7 @@ settings = {
         "llmModel": "qwen-qwq-32b",
         "maxContext": 4000,
         "autoRefresh": False
+        # Index, cache, context and reranker fields are filled in by init_services()
     }
 }
 
@@ -138,12 +154,95 @@ def process_predefined_urls():
         if not any(u["url"] == result["url"] for u in urls_db):
             urls_db.append(result)
             add_activity("url", result["url"])
+    return results
+
+# Seeding of the predefined URLs runs in the background, once across workers
+SEED_LOCK_FILE = "predefined_urls.lock"
+SEED_DONE_FILE = "predefined_urls.done"  # Written once the current list has been seeded
+app_ready = False
+seeding_status = {
+    "state": "pending",
+    "started_at": None,
+    "finished_at": None,
+    "error": None
+}
+
+def _seed_fingerprint() -> str:
+    return hashlib.sha256("\n".join(predefined_urls).encode()).hexdigest()
 
-# Load data and process predefined URLs on startup
+def _seeding_done() -> bool:
+    """Whether some worker already seeded the current list of predefined URLs"""
+    try:
+        with open(SEED_DONE_FILE, "r") as f:
+            return json.load(f).get("fingerprint") == _seed_fingerprint()
+    except (OSError, ValueError):
+        return False
+
+def seed_predefined_urls():
+    """Process the predefined URLs while holding a lock shared by all workers.
+
+    The first worker to get the lock does the crawling and records that the
+    list was seeded. The others wait for it, then only pick up the listing
+    entries, so URLs that failed for the leader are not fetched again by
+    every worker on every start. Changing the list seeds it again.
+    """
+    with open(SEED_LOCK_FILE, "w") as lock_file:
+        seeding_status["state"] = "waiting"
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            seeding_status["state"] = "running"
+            seeding_status["started_at"] = datetime.now().isoformat()
+            
+            # Pick up whatever another worker seeded while we waited
+            known_urls = {u["url"] for u in urls_db}
+            for entry in data_processor.get_all_urls():
+                if entry["url"] not in known_urls:
+                    urls_db.append(entry)
+            
+            if not _seeding_done():
+                results = process_predefined_urls()
+                with open(SEED_DONE_FILE, "w") as f:
+                    json.dump({
+                        "fingerprint": _seed_fingerprint(),
+                        "finished_at": datetime.now().isoformat(),
+                        "failed": [r["url"] for r in results if r["status"] == "error"]
+                    }, f)
+            seeding_status["state"] = "done"
+        except Exception as e:
+            print(f"Error seeding predefined URLs: {e}")
+            seeding_status["state"] = "failed"
+            seeding_status["error"] = str(e)
+        finally:
+            seeding_status["finished_at"] = datetime.now().isoformat()
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Load the persisted data on startup; seeding never gates readiness
 @app.on_event("startup")
 async def startup_event():
+    global app_ready
+    init_services()
     load_data()
-    process_predefined_urls()
+    job_queue.start()
+    app_ready = True
+    threading.Thread(target=seed_predefined_urls, name="seed-urls", daemon=True).start()
+
+# Liveness probe (public): the process is up and serving requests
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+# Readiness probe (public): the persisted index is loaded. Reports the index this worker
+# already has loaded; refreshing here could wait on another worker's compaction
+@app.get("/readyz")
+async def readyz():
+    body = {
+        "ready": app_ready,
+        "vectorDbSize": data_processor.get_vector_db_size(refresh=False) if app_ready else 0,
+        "seeding": seeding_status
+    }
+    return JSONResponse(body, status_code=status.HTTP_200_OK if app_ready else status.HTTP_503_SERVICE_UNAVAILABLE)
 
 # Models
 class ChatRequest(BaseModel):
@@ -172,6 +271,13 @@ class AdvancedSettings(BaseModel):
     llmModel: str
     maxContext: int
     autoRefresh: bool
+    indexType: Optional[str] = None
+    efSearch: Optional[int] = None
+    nprobe: Optional[int] = None
+    answerCacheThreshold: Optional[float] = None
+    contextTokens: Optional[int] = None  # 0 = derive the budget from maxContext
+    reranker: Optional[str] = None
+    rerankMinScore: Optional[float] = None  # Left out = the reranker's default cutoff
 
 class LoginRequest(BaseModel):
     username: str
@@ -207,37 +313,97 @@ def add_activity(activity_type, name):
     
     return activity_id
 
-# Background task to process URL
-def process_url_task(url: str):
-    result = data_processor.process_url(url)
+def _record_result(db: list, result: dict, activity_type: str, name: str):
+    """Replace the listing entry of a document (matched by its stable ID) with the job's result"""
+    for i, entry in enumerate(db):
+        if entry["id"] == result["id"]:
+            db[i] = {**entry, **result}
+            break
+    else:
+        db.append(result)
     
-    # Update URLs database
-    global urls_db
-    for i, u in enumerate(urls_db):
-        if u["url"] == url:
-            urls_db[i] = result
+    if result["status"] != "error":
+        add_activity(activity_type, name)
+
+def _sync_with_jobs(db: list):
+    """Settle listing entries still shown as processing from their jobs.
+
+    Any worker process may run a job, and only that process records the
+    result in its own listing, so the job is the authority here.
+    """
+    for i, entry in enumerate(db):
+        if entry.get("status") != "processing" or "jobId" not in entry:
+            continue
+        job = job_queue.get(entry["jobId"])
+        if job is None:
+            continue
+        if job["status"] == SUCCEEDED and job["result"]:
+            db[i] = {**entry, **job["result"]}
+        elif job["status"] in (FAILED, CANCELLED):
+            db[i] = {**entry, "status": "error", "message": job["message"]}
+
+def _record_placeholder(db: list, entry: dict):
+    """Show a queued document once, even when it is submitted again"""
+    for i, existing in enumerate(db):
+        if existing["id"] == entry["id"]:
+            db[i] = entry
             return
-    
-    urls_db.append(result)
-    
-    # Add activity
-    add_activity("url", url)
+    db.append(entry)
+
+# Job handler to process a URL; errors are raised so the queue retries them
+def process_url_job(payload: dict, job):
+    result = data_processor.process_url(payload["url"], progress=job.progress)
+    if result["status"] == "error":
+        raise RuntimeError(result["message"])
+    _record_result(urls_db, result, "url", payload["url"])
+    return result
 
-# Background task to process PDF
-def process_pdf_task(file_path: str, original_filename: str):
-    result = data_processor.process_pdf(file_path, original_filename)
-    
-    # Update PDFs database
-    global pdfs_db
-    for i, p in enumerate(pdfs_db):
-        if p["filename"] == original_filename:
-            pdfs_db[i] = result
-            return
+def process_url_failed(payload: dict, message: str):
+    _record_result(urls_db, {
+        "id": data_processor.document_id("url", payload["url"]),
+        "url": payload["url"],
+        "status": "error",
+        "message": message
+    }, "url", payload["url"])
+
+# Job handler to process a PDF
+def process_pdf_job(payload: dict, job):
+    result = data_processor.process_pdf(payload["file_path"], payload["original_filename"], progress=job.progress)
+    if result["status"] == "error":
+        raise RuntimeError(result["message"])
+    _record_result(pdfs_db, result, "pdf", payload["original_filename"])
+    return result
+
+def process_pdf_failed(payload: dict, message: str):
+    _record_result(pdfs_db, {
+        "id": data_processor.document_id("pdf", payload["file_path"]),
+        "filename": payload["original_filename"],
+        "status": "error",
+        "message": message
+    }, "pdf", payload["original_filename"])
+
+def init_services():
+    """Create the knowledge base, chatbot and job queue, once per API worker"""
+    global data_processor, chatbot, job_queue
+    if data_processor is not None:
+        return
+    data_processor = DataProcessor()
+    chatbot = Chatbot(data_processor)
     
-    pdfs_db.append(result)
+    # Ingestion runs as durable jobs, picked up by worker threads in every API worker
+    job_queue = JobQueue()
+    job_queue.register("url", process_url_job, on_failure=process_url_failed)
+    job_queue.register("pdf", process_pdf_job, on_failure=process_pdf_failed)
     
-    # Add activity
-    add_activity("pdf", original_filename)
+    settings["advanced"].update({
+        "indexType": data_processor.store.index_type,
+        "efSearch": data_processor.store.ef_search,
+        "nprobe": data_processor.store.nprobe,
+        "answerCacheThreshold": chatbot.answer_cache.threshold,
+        "contextTokens": chatbot.context_tokens,
+        "reranker": data_processor.reranker.name,
+        "rerankMinScore": data_processor.reranker.min_score
+    })
 
 # Login endpoint
 @app.post("/login")
@@ -277,38 +443,52 @@ async def auth_status(current_user: dict = Depends(get_current_user)):
 @app.post("/chat")
 async def chat(request: ChatRequest):
     try:
-        response = chatbot.generate_response(request.query)
+        response = await chatbot.agenerate_response(request.query)
         return {"response": response}
     except Exception as e:
         print(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming chat endpoint (public), Server-Sent Events
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    def event_stream():
+        for text in chatbot.stream_response(request.query):
+            yield f"data: {json.dumps({'token': text})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # URL endpoints (protected)
 @app.post("/process-url")
 async def process_url(
     request: UrlRequest, 
-    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
+    # Validate URL
+    if not request.url.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="Invalid URL format")
+    
     try:
-        # Validate URL
-        if not request.url.startswith(("http://", "https://")):
-            raise HTTPException(status_code=400, detail="Invalid URL format")
-        
-        # Add URL processing to background tasks
-        background_tasks.add_task(process_url_task, request.url)
+        # Queue the URL; a job already pending for it is reused
+        doc_id = data_processor.document_id("url", request.url)
+        job = await run_in_threadpool(job_queue.submit, "url", {"url": request.url}, doc_id)
         
         # Return immediate response
-        url_id = str(uuid.uuid4())
         result = {
-            "id": url_id,
+            "id": doc_id,
             "url": request.url,
             "added_date": datetime.now().isoformat(),
-            "status": "processing"
+            "status": "processing",
+            "jobId": job["id"]
         }
         
-        # Add to URLs database
-        urls_db.append(result)
+        # Add to URLs database, once per document
+        _record_placeholder(urls_db, result)
         
         return result
     except Exception as e:
@@ -316,6 +496,7 @@ async def process_url(
 
 @app.get("/urls")
 async def get_urls(current_user: dict = Depends(get_current_user)):
+    await run_in_threadpool(_sync_with_jobs, urls_db)
     return urls_db
 
 @app.delete("/urls/{url_id}")
@@ -323,6 +504,9 @@ async def delete_url(
     url_id: str,
     current_user: dict = Depends(get_current_user)
 ):
+    # Drop its vectors and metadata so it stops showing up in answers
+    deleted = await run_in_threadpool(data_processor.delete_document, url_id)
+    
     for i, url in enumerate(urls_db):
         if url["id"] == url_id:
             # Remove from URLs database
@@ -333,13 +517,14 @@ async def delete_url(
             
             return {"success": True}
     
+    if deleted:
+        return {"success": True}
     raise HTTPException(status_code=404, detail="URL not found")
 
 # PDF endpoints (protected)
 @app.post("/process-pdf")
 async def process_pdf(
     file: UploadFile = File(...), 
-    background_tasks: BackgroundTasks = None,
     current_user: dict = Depends(get_current_user)
 ):
     try:
@@ -352,23 +537,28 @@ async def process_pdf(
         with open(file_path, "wb") as f:
             shutil.copyfileobj(file.file, f)
         
-        # Add PDF processing to background tasks
-        background_tasks.add_task(process_pdf_task, file_path, file.filename)
+        # Queue the PDF; the saved upload survives restarts along with the job
+        doc_id = data_processor.document_id("pdf", file_path)
+        job = await run_in_threadpool(
+            job_queue.submit, "pdf", {"file_path": file_path, "original_filename": file.filename}, doc_id
+        )
         
         # Return immediate response
-        pdf_id = str(uuid.uuid4())
         result = {
-            "id": pdf_id,
+            "id": doc_id,
             "filename": file.filename,
             "added_date": datetime.now().isoformat(),
             "status": "processing",
-            "size": os.path.getsize(file_path)
+            "size": os.path.getsize(file_path),
+            "jobId": job["id"]
         }
         
-        # Add to PDFs database
-        pdfs_db.append(result)
+        # Add to PDFs database, once per document
+        _record_placeholder(pdfs_db, result)
         
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         # Clean up the file if it exists
         if os.path.exists(f"uploads/{file.filename}"):
@@ -378,6 +568,7 @@ async def process_pdf(
 
 @app.get("/pdfs")
 async def get_pdfs(current_user: dict = Depends(get_current_user)):
+    await run_in_threadpool(_sync_with_jobs, pdfs_db)
     return pdfs_db
 
 @app.delete("/pdfs/{pdf_id}")
@@ -385,6 +576,9 @@ async def delete_pdf(
     pdf_id: str,
     current_user: dict = Depends(get_current_user)
 ):
+    # Drop its vectors and metadata so it stops showing up in answers
+    deleted = await run_in_threadpool(data_processor.delete_document, pdf_id)
+    
     for i, pdf in enumerate(pdfs_db):
         if pdf["id"] == pdf_id:
             # Remove from PDFs database
@@ -395,15 +589,44 @@ async def delete_pdf(
             
             return {"success": True}
     
+    if deleted:
+        return {"success": True}
     raise HTTPException(status_code=404, detail="PDF not found")
 
-# Dashboard stats endpoint (protected)
+# Ingestion job endpoints (protected)
+@app.get("/jobs")
+async def get_jobs(status: Optional[str] = None, limit: int = 100, current_user: dict = Depends(get_current_user)):
+    return await run_in_threadpool(job_queue.list, status, limit)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await run_in_threadpool(job_queue.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Dashboard stats endpoint (protected); a plain def, so FastAPI runs it in the threadpool:
+# reading the index size can reload the store or wait for another worker's log lock
 @app.get("/stats")
-async def get_stats(current_user: dict = Depends(get_current_user)):
+def get_stats(current_user: dict = Depends(get_current_user)):
     # Calculate stats
     total_urls = len(urls_db)
     total_pdfs = len(pdfs_db)
     vector_db_size = data_processor.get_vector_db_size()
+    index_memory = data_processor.get_index_memory_stats()
+    query_cache = data_processor.get_query_cache_stats()
+    answer_cache = chatbot.answer_cache.stats()
+    context_stats = chatbot.get_context_stats()
+    rerank_stats = data_processor.get_rerank_stats()
+    embedding_stats = data_processor.get_embedding_stats()
+    conversation_log = chatbot.conversation_log.stats()
     
     # Calculate URLs and PDFs added in the last week
     one_week_ago = datetime.now() - timedelta(days=7)
@@ -419,8 +642,9 @@ async def get_stats(current_user: dict = Depends(get_current_user)):
     # Check system status
     system_status = [
         {"name": "Vector Database", "operational": True},
-        {"name": "Embedding API", "operational": bool(settings["api_keys"]["cohereApiKey"])},
-        {"name": "LLM API", "operational": bool(settings["api_keys"]["groqApiKey"])},
+        # Local providers need no key
+        {"name": "Embedding API", "operational": data_processor.embedder.name != "cohere" or bool(settings["api_keys"]["cohereApiKey"])},
+        {"name": "LLM API", "operational": chatbot.llm.name != "groq" or bool(settings["api_keys"]["groqApiKey"])},
         {"name": "Chat Interface", "operational": True}
     ]
     
@@ -428,6 +652,20 @@ async def get_stats(current_user: dict = Depends(get_current_user)):
         "totalUrls": total_urls,
         "totalPdfs": total_pdfs,
         "vectorDbSize": vector_db_size,
+        "indexType": index_memory["index_type"],
+        "bytesPerVector": index_memory["bytes_per_vector"],
+        "indexMemoryBytes": index_memory["index_bytes"],
+        "queryCacheHitRate": query_cache["hit_rate"],
+        "queryCacheEntries": query_cache["entries"],
+        "answerCacheHitRate": answer_cache["hit_rate"],
+        "answerCacheEntries": answer_cache["entries"],
+        "contextBudgetTokens": context_stats["budget"],
+        "avgContextTokens": context_stats["avg_tokens"],
+        "reranker": rerank_stats["reranker"],
+        "queriesBelowCutoff": rerank_stats["queries_below_cutoff"],
+        "embeddingRequests": embedding_stats["requests"],
+        "avgEmbeddingBatch": embedding_stats["avg_batch"],
+        "conversationLogDropped": conversation_log["dropped"],
         "urlsLastWeek": urls_last_week,
         "pdfsLastWeek": pdfs_last_week,
         "lastUpdated": {
@@ -509,11 +747,49 @@ async def update_advanced_settings(
     advanced_settings: AdvancedSettings,
     current_user: dict = Depends(get_current_user)
 ):
-    settings["advanced"] = advanced_settings.dict()
+    # Index fields are optional; keep the current values for any that were left out
+    new_settings = settings["advanced"].copy()
+    new_settings.update({k: v for k, v in advanced_settings.dict().items() if v is not None})
+    if not 0 < new_settings["answerCacheThreshold"] <= 1:
+        raise HTTPException(status_code=400, detail="answerCacheThreshold must be in (0, 1]")
+    if new_settings["contextTokens"] is not None and new_settings["contextTokens"] < 0:
+        raise HTTPException(status_code=400, detail="contextTokens must not be negative")
+    for knob in ("efSearch", "nprobe"):
+        if new_settings[knob] < 1:
+            raise HTTPException(status_code=400, detail=f"{knob} must be a positive integer")
+    if new_settings["reranker"] not in RERANKERS:
+        raise HTTPException(status_code=400, detail=f"reranker must be one of: {', '.join(RERANKERS)}")
+    
+    # Loading a model and switching index type are slow, so keep both off the event loop.
+    # The reranker is built first: if it cannot load, the index has not been touched yet
+    try:
+        reranker = await run_in_threadpool(
+            data_processor.build_reranker,
+            new_settings["reranker"],
+            advanced_settings.rerankMinScore
+        )
+        await run_in_threadpool(
+            data_processor.update_index_settings,
+            new_settings["indexType"],
+            new_settings["efSearch"],
+            new_settings["nprobe"]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # A cutoff only carries over when given: each reranker scores on its own scale
+    data_processor.update_rerank_settings(new_settings["reranker"], advanced_settings.rerankMinScore, reranker)
+    
+    new_settings["rerankMinScore"] = data_processor.reranker.min_score
+    settings["advanced"] = new_settings
     
     # Update the advanced settings in the data processor and chatbot
-    data_processor.update_settings(advanced_settings.embeddingModel, advanced_settings.maxContext)
-    chatbot.update_settings(advanced_settings.llmModel, advanced_settings.maxContext)
+    data_processor.update_settings(advanced_settings.embeddingModel)
+    chatbot.update_settings(
+        advanced_settings.llmModel,
+        advanced_settings.maxContext,
+        answer_cache_threshold=new_settings["answerCacheThreshold"],
+        context_tokens=new_settings["contextTokens"]
+    )
     
     return {"success": True}
 
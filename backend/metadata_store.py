@@ -0,0 +1,287 @@
+import os
+import re
+import json
+import sqlite3
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Configuration
+METADATA_DB_FILE = "company_metadata.db"
+# Query terms found in more than this share of chunks are left out of keyword search: they
+# barely move BM25, and scoring their long posting lists is what makes the query slow
+LEXICAL_MAX_DF = float(os.environ.get("LEXICAL_MAX_DF", "0.1"))
+LEXICAL_TIME_BUDGET = float(os.environ.get("LEXICAL_TIME_BUDGET", "0.05"))  # Seconds, then keyword search gives up
+LEXICAL_STATS_TTL = 60.0  # Seconds the chunk count used for LEXICAL_MAX_DF is reused
+
+# Fields copied into their own columns so they can be indexed and filtered on
+INDEXED_FIELDS = ("doc_id", "type", "source", "added_date", "content_hash")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    vector_id INTEGER PRIMARY KEY,
+    doc_id TEXT,
+    type TEXT,
+    source TEXT,
+    added_date TEXT,
+    content_hash TEXT,
+    metadata TEXT NOT NULL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks(doc_id);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+CREATE INDEX IF NOT EXISTS idx_chunks_type ON chunks(type, source);
+CREATE INDEX IF NOT EXISTS idx_chunks_added_date ON chunks(added_date);
+"""
+
+_TOKENIZER = "porter unicode61 remove_diacritics 2"
+
+# Full-text index over the chunk text, kept in step with the chunks table by triggers
+_LEXICAL_SCHEMA = (
+    "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+    f"text, content='chunks', content_rowid='vector_id', tokenize='{_TOKENIZER}')",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN "
+    "INSERT INTO chunks_fts(rowid, text) VALUES (new.vector_id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN "
+    "INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.vector_id, old.text); END",
+)
+
+_TERM = re.compile(r'\w+')
+
+# Left out of lexical queries: they match almost every chunk and add nothing to the ranking
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or our "
+    "tell that the this to was we what when where which who why will with you your".split()
+)
+
+class MetadataStore:
+    """Chunk metadata and text in SQLite, keyed by FAISS vector ID.
+
+    Rows are written once at insert time and never rewritten, so the cost of
+    an insert does not grow with the corpus. Listing queries read only the
+    small indexed columns and the metadata JSON; the chunk text is fetched
+    only for the rows a search actually returns.
+
+    The chunk text is also indexed in an FTS5 table for BM25 keyword search.
+    Triggers maintain it on every insert and delete, so it grows
+    incrementally with ingestion and every process sees the same index.
+
+    Each thread gets its own connection. The database runs in WAL journal
+    mode, so searches in any process read while another process writes.
+    """
+
+    def __init__(self, path: str = METADATA_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        self.lexical = self._create_lexical_index()
+
+    def _create_lexical_index(self) -> bool:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+            ).fetchone()
+            if not exists:
+                for statement in _LEXICAL_SCHEMA:
+                    conn.execute(statement)
+                # Index the chunks stored before the full-text index existed
+                conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+            # Per-term document frequencies, read straight from the full-text index
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts_vocab USING fts5vocab(chunks_fts, row)")
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Keyword search disabled: {e}")
+            return False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # INSERT OR REPLACE must fire the delete trigger of the row it replaces
+            conn.execute("PRAGMA recursive_triggers=ON")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(record: Dict, vector_id: int) -> tuple:
+        meta = {key: value for key, value in record.items() if key != 'text'}
+        return (vector_id, *(meta.get(field) for field in INDEXED_FIELDS),
+                json.dumps(meta), record.get('text'))
+
+    @staticmethod
+    def _record(metadata: str, text: Optional[str] = None) -> Dict:
+        record = json.loads(metadata)
+        if text is not None:
+            record['text'] = text
+        return record
+
+    def put(self, records: Dict[int, Dict]):
+        """Insert (or replace) the records for the given vector IDs in one transaction"""
+        if not records:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(record, vector_id) for vector_id, record in records.items()]
+            )
+
+    def get(self, vector_ids: Iterable[int], with_text: bool = True) -> Dict[int, Dict]:
+        """Records for the given vector IDs; IDs without a row are left out"""
+        ids = [int(vector_id) for vector_id in vector_ids]
+        if not ids:
+            return {}
+        columns = "vector_id, metadata, text" if with_text else "vector_id, metadata, NULL"
+        placeholders = ",".join("?" * len(ids))
+        rows = self._connect().execute(
+            f"SELECT {columns} FROM chunks WHERE vector_id IN ({placeholders})", ids
+        ).fetchall()
+        return {vector_id: self._record(metadata, text) for vector_id, metadata, text in rows}
+
+    def delete(self, vector_ids: Iterable[int]):
+        ids = [(int(vector_id),) for vector_id in vector_ids]
+        if not ids:
+            return
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE vector_id = ?", ids)
+
+    def _stems(self, terms: List[str]) -> List[List[str]]:
+        """The index's own tokens for each term, from a scratch in-memory table with the same tokenizer"""
+        conn = getattr(self._local, 'tokenizer', None)
+        if conn is None:
+            conn = sqlite3.connect(":memory:")
+            conn.execute(f"CREATE VIRTUAL TABLE terms USING fts5(term, tokenize='{_TOKENIZER}')")
+            conn.execute("CREATE VIRTUAL TABLE terms_vocab USING fts5vocab(terms, instance)")
+            self._local.tokenizer = conn
+        with conn:
+            conn.execute("DELETE FROM terms")
+            conn.executemany("INSERT INTO terms(rowid, term) VALUES (?, ?)", enumerate(terms))
+            stems = [[] for _ in terms]
+            for position, stem in conn.execute("SELECT doc, term FROM terms_vocab"):
+                stems[position].append(stem)
+        return stems
+
+    def _lexical_stats(self) -> Tuple[int, Dict[str, int]]:
+        """Chunk count and a document-frequency cache, both refreshed every LEXICAL_STATS_TTL seconds.
+
+        fts5vocab counts a term's documents by walking its posting list, so
+        the frequencies of common terms are worth reusing across queries.
+        """
+        stats = getattr(self._local, 'lexical_stats', None)
+        if stats is None or time.monotonic() - stats[0] > LEXICAL_STATS_TTL:
+            stats = (time.monotonic(), self.count(), {})
+            self._local.lexical_stats = stats
+        return stats[1], stats[2]
+
+    def _selective_terms(self, terms: List[str]) -> List[str]:
+        """Drop terms found in more than LEXICAL_MAX_DF of the chunks, keeping at least the rarest one"""
+        try:
+            chunks, cache = self._lexical_stats()
+            limit = LEXICAL_MAX_DF * chunks
+            conn = self._connect()
+            frequencies = []
+            for term, stems in zip(terms, self._stems(terms)):
+                df = 0
+                for stem in stems:
+                    if stem not in cache:
+                        row = conn.execute("SELECT doc FROM chunks_fts_vocab WHERE term = ?", (stem,)).fetchone()
+                        cache[stem] = row[0] if row else 0
+                    df = max(df, cache[stem])
+                frequencies.append((df, term))
+        except sqlite3.Error as e:
+            print(f"Keyword statistics unavailable, searching every term: {e}")
+            return terms
+        selective = [term for df, term in frequencies if df <= limit]
+        return selective or [min(frequencies)[1]]
+
+    def lexical_search(self, query: str, k: int, time_budget: float = LEXICAL_TIME_BUDGET) -> List[Tuple[int, float]]:
+        """(vector ID, BM25 score) of the ``k`` chunks that best match the query's terms, best first.
+
+        Only the query's selective terms are searched (see LEXICAL_MAX_DF),
+        and a search still running after ``time_budget`` seconds is given up
+        with no results rather than holding up the answer.
+        """
+        if not self.lexical:
+            return []
+        terms = list(dict.fromkeys(_TERM.findall(query.lower())))
+        terms = [term for term in terms if term not in STOPWORDS] or terms
+        if not terms:
+            return []
+        terms = self._selective_terms(terms)
+        # Quoted terms: punctuation and FTS5 operators in the query are never parsed as syntax
+        match = " OR ".join(f'"{term}"' for term in terms)
+        conn = self._connect()
+        deadline = time.monotonic() + time_budget
+        # A non-zero return from the progress handler interrupts the statement
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            rows = conn.execute(
+                "SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match, k)
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                print(f"Keyword search exceeded {time_budget * 1000:.0f} ms, skipped")
+            else:
+                print(f"Keyword search error: {e}")
+            return []
+        except sqlite3.Error as e:
+            print(f"Keyword search error: {e}")
+            return []
+        finally:
+            conn.set_progress_handler(None, 0)
+        # FTS5 ranks better matches lower; flip the sign so higher is better
+        return [(vector_id, -score) for vector_id, score in rows]
+
+    def vector_ids(self, doc_type: str, source: str) -> List[int]:
+        """Vector IDs of every chunk of one source document"""
+        rows = self._connect().execute(
+            "SELECT vector_id FROM chunks WHERE type = ? AND source = ? ORDER BY vector_id",
+            (doc_type, source)
+        ).fetchall()
+        return [vector_id for vector_id, in rows]
+
+    def documents(self, doc_type: str) -> List[Dict]:
+        """One record (the first chunk, without text) per source document of a type, oldest first"""
+        rows = self._connect().execute(
+            "SELECT metadata FROM chunks WHERE vector_id IN "
+            "(SELECT MIN(vector_id) FROM chunks WHERE type = ? GROUP BY source) "
+            "ORDER BY vector_id", (doc_type,)
+        ).fetchall()
+        return [self._record(metadata) for metadata, in rows]
+
+    def sources(self, doc_type: str) -> Set[str]:
+        rows = self._connect().execute(
+            "SELECT DISTINCT source FROM chunks WHERE type = ?", (doc_type,)
+        ).fetchall()
+        return {source for source, in rows}
+
+    def content_hashes(self, doc_type: str) -> Set[str]:
+        rows = self._connect().execute(
+            "SELECT DISTINCT content_hash FROM chunks WHERE type = ? AND content_hash IS NOT NULL",
+            (doc_type,)
+        ).fetchall()
+        return {content_hash for content_hash, in rows}
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def migrate_json(self, json_file: str) -> int:
+        """Import a legacy metadata JSON list (position = vector ID) and set the file aside"""
+        if not os.path.exists(json_file) or self.count():
+            return 0
+        with open(json_file, 'r') as f:
+            metadata = json.load(f)
+        self.put(dict(enumerate(metadata)))
+        try:
+            os.replace(json_file, json_file + ".migrated")
+        except OSError:
+            pass  # Another process got there first
+        print(f"Migrated {len(metadata)} metadata records from {json_file}")
+        return len(metadata)
@@ -0,0 +1,154 @@
+import os
+import io
+import time
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Union
+
+import PyPDF2
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, the memory cap is not enforced
+    resource = None
+
+# Configuration
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 = in-process
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "25"))
+PDF_EXTRACT_TIMEOUT = float(os.environ.get("PDF_EXTRACT_TIMEOUT", "300"))  # Seconds per document
+PDF_EXTRACT_MEMORY_MB = int(os.environ.get("PDF_EXTRACT_MEMORY_MB", "1024"))  # Address space per worker
+PDF_TIMEOUT_GRACE = 5.0  # Extra wait before a worker that ignores its alarm is considered hung
+
+PdfSource = Union[str, bytes]
+
+class PdfExtractionError(Exception):
+    """A PDF could not be extracted within the time or memory limits"""
+
+def _limit_worker(memory_mb: int):
+    """Pool initializer: cap the worker's address space so a runaway PDF fails with MemoryError"""
+    if resource is not None and memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _on_alarm(signum, frame):
+    raise PdfExtractionError("PDF extraction timed out")
+
+def _extract_range(source: PdfSource, start: int, end: int, deadline: float) -> tuple:
+    """Extract pages [start, end) in a worker; returns (page count, page texts)"""
+    # Pool tasks run on the worker's main thread, so a timer signal can interrupt a stuck parse
+    alarm = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if alarm:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise PdfExtractionError("PDF extraction timed out")
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        reader = PyPDF2.PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+        pages = reader.pages
+        return len(pages), [pages[n].extract_text() or "" for n in range(start, min(end, len(pages)))]
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+class PdfExtractor:
+    """PDF text extraction in a process pool, so parsing never holds the API worker's GIL.
+
+    The first task extracts the first ``pages_per_task`` pages and reports
+    the page count; the rest of a larger document is split into page ranges
+    that run on all workers at once. Pages are yielded in page order as the
+    ranges complete. Every document has a deadline of ``timeout`` seconds
+    and every worker an address-space cap of ``memory_mb``, so a
+    pathological PDF fails on its own instead of stalling ingestion. A
+    worker that crashes or hangs past the deadline takes the pool down with
+    it; the pool is then replaced for the next document.
+    """
+
+    def __init__(self, workers: int = PDF_EXTRACT_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK,
+                 timeout: float = PDF_EXTRACT_TIMEOUT, memory_mb: int = PDF_EXTRACT_MEMORY_MB):
+        self.workers = workers
+        self.pages_per_task = max(1, pages_per_task)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: forking a process that runs FAISS and server threads is not safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_limit_worker,
+                    initargs=(self.memory_mb,)
+                )
+            return self._pool
+
+    def _reset(self, pool: ProcessPoolExecutor):
+        """Throw away a broken or hung pool; the next document starts a fresh one"""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def iter_pages(self, source: PdfSource, progress: Callable[[int, int], None] = None) -> Iterator[str]:
+        """Yield the text of every page in page order; ``progress(done, total)`` after each range.
+
+        ``source`` is a file path or the PDF bytes. Raises PdfExtractionError
+        when the document exceeds its time or memory limit.
+        """
+        deadline = time.time() + self.timeout
+        if self.workers <= 0:
+            total, pages = _extract_range(source, 0, float('inf'), deadline)
+            if progress:
+                progress(total, total)
+            yield from pages
+            return
+
+        pool = self._executor()
+        futures = []
+        try:
+            total, pages = self._result(pool, pool.submit(_extract_range, source, 0, self.pages_per_task, deadline), deadline)
+            futures = [
+                pool.submit(_extract_range, source, start, start + self.pages_per_task, deadline)
+                for start in range(self.pages_per_task, total, self.pages_per_task)
+            ]
+            done = len(pages)
+            if progress:
+                progress(done, total)
+            yield from pages
+            for future in futures:
+                _, pages = self._result(pool, future, deadline)
+                done += len(pages)
+                if progress:
+                    progress(done, total)
+                yield from pages
+        finally:
+            # The consumer stopped early or a range failed: do not leave the rest queued
+            for future in futures:
+                future.cancel()
+
+    def _result(self, pool: ProcessPoolExecutor, future, deadline: float) -> tuple:
+        try:
+            return future.result(timeout=max(0.0, deadline - time.time()) + PDF_TIMEOUT_GRACE)
+        except PdfExtractionError:
+            raise  # The worker hit the deadline itself and is fine
+        except FutureTimeout:
+            self._reset(pool)
+            raise PdfExtractionError(f"PDF extraction exceeded {self.timeout:.0f}s")
+        except MemoryError:
+            raise PdfExtractionError(f"PDF extraction exceeded {self.memory_mb} MB")
+        except BrokenProcessPool:
+            self._reset(pool)
+            raise PdfExtractionError("PDF extraction worker crashed")
+
+    def extract_pages(self, source: PdfSource, progress: Callable[[int, int], None] = None) -> List[str]:
+        return list(self.iter_pages(source, progress))
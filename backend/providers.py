@@ -0,0 +1,252 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List
+
+import httpx
+import numpy as np
+import cohere
+from groq import Groq
+
+from vector_store import EMBEDDING_DIM
+from metadata_store import STOPWORDS
+
+# Configuration
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "cohere")  # cohere | hash
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "groq")  # groq | canned
+EMBEDDING_MODEL = "embed-english-v3.0"
+LLM_MODEL = "qwen-qwq-32b"
+
+# Per-provider limits; the concurrency limit also sizes the provider's connection pool
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "8"))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "8"))
+EMBED_TIMEOUT = float(os.environ.get("EMBED_TIMEOUT", "30"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+
+# Simulated upstream latency of the local providers, for load tests (seconds)
+LOCAL_EMBED_LATENCY = float(os.environ.get("LOCAL_EMBED_LATENCY", "0"))
+LOCAL_LLM_LATENCY = float(os.environ.get("LOCAL_LLM_LATENCY", "0"))
+LOCAL_LLM_TOKEN_DELAY = float(os.environ.get("LOCAL_LLM_TOKEN_DELAY", "0"))
+
+_TERM = re.compile(r'\w+')
+
+def _http_client(concurrency: int, timeout: float) -> httpx.Client:
+    """A pooled HTTP client kept for the provider's lifetime, so connections are reused across calls"""
+    return httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    )
+
+class EmbeddingProvider(ABC):
+    """Turns texts into embedding vectors.
+
+    ``embed`` holds one of ``concurrency`` slots for the duration of the
+    call, so no more requests than that are ever in flight to the provider.
+    ``model`` can be changed at any time and applies to the next call.
+    """
+
+    name = "base"
+
+    def __init__(self, model: str = EMBEDDING_MODEL, concurrency: int = EMBED_CONCURRENCY):
+        self.model = model
+        self.concurrency = concurrency
+        self._limiter = threading.BoundedSemaphore(concurrency)
+
+    def embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        """Embed texts; ``input_type`` is "search_document" or "search_query"."""
+        with self._limiter:
+            return self._embed(texts, input_type)
+
+    @abstractmethod
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        ...
+
+    def set_api_key(self, api_key: str):
+        pass
+
+class CohereEmbeddings(EmbeddingProvider):
+    name = "cohere"
+
+    def __init__(self, api_key: str, model: str = EMBEDDING_MODEL, concurrency: int = EMBED_CONCURRENCY,
+                 timeout: float = EMBED_TIMEOUT):
+        super().__init__(model, concurrency)
+        self.timeout = timeout
+        self._http = _http_client(concurrency, timeout)
+        self.set_api_key(api_key)
+
+    def set_api_key(self, api_key: str):
+        # The pooled connections stay; only the SDK client carrying the key is replaced
+        self.client = cohere.Client(api_key, timeout=self.timeout, httpx_client=self._http)
+
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        response = self.client.embed(texts=texts, model=self.model, input_type=input_type)
+        return response.embeddings
+
+class HashEmbeddings(EmbeddingProvider):
+    """Deterministic offline embeddings by feature hashing of words and their character trigrams.
+
+    Texts that share words (or word stems, through the trigrams) get
+    similar vectors, so retrieval and reranking over them behave sensibly,
+    but nothing leaves the machine. Meant for tests, benchmarks and load
+    tests of the pipeline itself.
+    """
+
+    name = "hash"
+
+    def __init__(self, model: str = "hash", concurrency: int = EMBED_CONCURRENCY, dim: int = EMBEDDING_DIM,
+                 latency: float = LOCAL_EMBED_LATENCY):
+        super().__init__(model, concurrency)
+        self.dim = dim
+        self.latency = latency
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        features = []
+        for term in _TERM.findall(text.lower()):
+            if term in STOPWORDS:
+                continue
+            padded = f"^{term}$"
+            features.append(term)
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype='float32')
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def _embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+class CompletionProvider(ABC):
+    """Chat completions, whole or streamed, with the same concurrency slots as EmbeddingProvider"""
+
+    name = "base"
+
+    def __init__(self, model: str = LLM_MODEL, concurrency: int = LLM_CONCURRENCY):
+        self.model = model
+        self.concurrency = concurrency
+        self._limiter = threading.BoundedSemaphore(concurrency)
+
+    def complete(self, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 500) -> str:
+        with self._limiter:
+            return self._complete(messages, temperature, max_tokens)
+
+    def stream(self, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 500) -> Iterator[str]:
+        """Yield the answer in pieces; the slot is held until the stream is consumed or closed"""
+        with self._limiter:
+            yield from self._stream(messages, temperature, max_tokens)
+
+    @abstractmethod
+    def _complete(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        ...
+
+    @abstractmethod
+    def _stream(self, messages: List[Dict], temperature: float, max_tokens: int) -> Iterator[str]:
+        ...
+
+    def set_api_key(self, api_key: str):
+        pass
+
+class GroqCompletions(CompletionProvider):
+    name = "groq"
+
+    def __init__(self, api_key: str, model: str = LLM_MODEL, concurrency: int = LLM_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT):
+        super().__init__(model, concurrency)
+        self.timeout = timeout
+        self._http = _http_client(concurrency, timeout)
+        self.set_api_key(api_key)
+
+    def set_api_key(self, api_key: str):
+        self.client = Groq(api_key=api_key, timeout=self.timeout, http_client=self._http)
+
+    def _complete(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return completion.choices[0].message.content
+
+    def _stream(self, messages: List[Dict], temperature: float, max_tokens: int) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+class CannedCompletions(CompletionProvider):
+    """Deterministic offline LLM: answers with the first sentence of the prompt's context.
+
+    The answer depends only on the prompt, so repeated runs are comparable,
+    and the optional latency and per-word delay stand in for the upstream
+    model in load tests.
+    """
+
+    name = "canned"
+
+    def __init__(self, model: str = "canned", concurrency: int = LLM_CONCURRENCY,
+                 latency: float = LOCAL_LLM_LATENCY, token_delay: float = LOCAL_LLM_TOKEN_DELAY):
+        super().__init__(model, concurrency)
+        self.latency = latency
+        self.token_delay = token_delay
+
+    @staticmethod
+    def _answer(messages: List[Dict], max_tokens: int) -> str:
+        prompt = messages[-1]['content'] if messages else ""
+        context = prompt.split("Context:", 1)[-1].split("Question:", 1)[0].strip()
+        sentence = re.split(r'(?<=[.!?])\s', context, maxsplit=1)[0] if context else ""
+        words = (sentence or "I don't have that information in my knowledge base.").split()
+        return " ".join(words[:max_tokens])
+
+    def _complete(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        answer = self._answer(messages, max_tokens)
+        if self.token_delay:
+            time.sleep(self.token_delay * len(answer.split()))
+        return answer
+
+    def _stream(self, messages: List[Dict], temperature: float, max_tokens: int) -> Iterator[str]:
+        if self.latency:
+            time.sleep(self.latency)
+        for n, word in enumerate(self._answer(messages, max_tokens).split()):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield word if n == 0 else " " + word
+
+EMBEDDING_PROVIDERS = (CohereEmbeddings.name, HashEmbeddings.name)
+LLM_PROVIDERS = (GroqCompletions.name, CannedCompletions.name)
+
+def make_embedding_provider(name: str = EMBEDDING_PROVIDER, api_key: str = None) -> EmbeddingProvider:
+    """Build an embedding provider by name; raises ValueError for an unknown one"""
+    if name == CohereEmbeddings.name:
+        return CohereEmbeddings(api_key)
+    if name == HashEmbeddings.name:
+        return HashEmbeddings()
+    raise ValueError(f"Unknown embedding provider: {name} (choose from {', '.join(EMBEDDING_PROVIDERS)})")
+
+def make_completion_provider(name: str = LLM_PROVIDER, api_key: str = None) -> CompletionProvider:
+    """Build a completion provider by name; raises ValueError for an unknown one"""
+    if name == GroqCompletions.name:
+        return GroqCompletions(api_key)
+    if name == CannedCompletions.name:
+        return CannedCompletions()
+    raise ValueError(f"Unknown LLM provider: {name} (choose from {', '.join(LLM_PROVIDERS)})")
@@ -0,0 +1,162 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Configuration
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2048"))  # Entries kept in memory
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "86400"))  # Seconds before an entry is re-embedded
+# Shared tier for all workers on the host; set to an empty string to disable it
+QUERY_CACHE_DB = os.environ.get("QUERY_CACHE_DB", "query_embeddings.db")
+QUERY_CACHE_DISK_SIZE = int(os.environ.get("QUERY_CACHE_DISK_SIZE", "50000"))
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_query(query: str) -> str:
+    """Cache key for a query: case, extra whitespace and closing punctuation do not change what is asked"""
+    return _WHITESPACE.sub(' ', query.lower()).strip().rstrip('?!. ')
+
+class QueryEmbeddingCache:
+    """LRU cache of normalized query -> query embedding, with a TTL.
+
+    The in-process tier is an OrderedDict bounded to ``max_entries``. When
+    ``db_path`` is set, misses fall through to a SQLite table that every
+    worker reads and writes, so a question embedded by one worker is a hit
+    in all of them. Entries are keyed by embedding model as well, and
+    ``invalidate`` drops everything from other models when it changes.
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL,
+                 db_path: str = QUERY_CACHE_DB, disk_entries: int = QUERY_CACHE_DISK_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self.disk_entries = disk_entries
+
+        self._entries: OrderedDict = OrderedDict()  # (model, query) -> (expires_at, embedding)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disk_writes = 0
+
+        # Counters for monitoring
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                        "model TEXT, query TEXT, embedding BLOB, created REAL, "
+                        "PRIMARY KEY (model, query))"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_created ON query_embeddings(created)")
+            except sqlite3.Error as e:
+                print(f"Query cache disk tier disabled: {e}")
+                self.db_path = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # It is a cache: losing the tail on a crash is fine
+            self._local.conn = conn
+        return conn
+
+    def get(self, query: str, model: str) -> Optional[List[float]]:
+        key = (model, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        embedding = self._disk_get(key, now)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, embedding, now)
+        return embedding
+
+    def put(self, query: str, model: str, embedding: List[float]):
+        key = (model, normalize_query(query))
+        now = time.time()
+        self._remember(key, embedding, now)
+        self._disk_put(key, embedding, now)
+
+    def _remember(self, key: tuple, embedding: List[float], now: float):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_get(self, key: tuple, now: float) -> Optional[List[float]]:
+        if not self.db_path:
+            return None
+        try:
+            row = self._connect().execute(
+                "SELECT embedding FROM query_embeddings WHERE model = ? AND query = ? AND created > ?",
+                (*key, now - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Query cache read error: {e}")
+            return None
+        return np.frombuffer(row[0], dtype='float32').tolist() if row else None
+
+    def _disk_put(self, key: tuple, embedding: List[float], now: float):
+        if not self.db_path:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                    (*key, np.asarray(embedding, dtype='float32').tobytes(), now)
+                )
+                self._disk_writes += 1
+                # Trim expired and least recently written entries now and then, not on every write
+                if self._disk_writes % 256 == 0:
+                    conn.execute("DELETE FROM query_embeddings WHERE created <= ?", (now - self.ttl,))
+                    conn.execute(
+                        "DELETE FROM query_embeddings WHERE rowid IN (SELECT rowid FROM query_embeddings "
+                        "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.disk_entries,)
+                    )
+        except sqlite3.Error as e:
+            print(f"Query cache write error: {e}")
+
+    def invalidate(self, keep_model: str = None):
+        """Drop cached embeddings, except those of ``keep_model`` if given"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] != keep_model]:
+                del self._entries[key]
+        if not self.db_path:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM query_embeddings WHERE model IS NOT ?", (keep_model,))
+        except sqlite3.Error as e:
+            print(f"Query cache invalidation error: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            }
@@ -0,0 +1,127 @@
+import os
+import re
+import math
+import threading
+from typing import Dict, List, Optional
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:  # Optional: only needed for the cross_encoder reranker
+    CrossEncoder = None
+
+from metadata_store import STOPWORDS
+
+# Configuration
+RERANKER = os.environ.get("RERANKER", "cosine")
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))  # Over-fetched from retrieval, then rescored
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+_TERM = re.compile(r'\w+')
+
+class Reranker:
+    """Rescores retrieved candidates for a query.
+
+    ``rerank`` sets ``rerank_score`` on every document it can score (higher
+    is more relevant) and returns the documents best first. Documents it
+    cannot score get ``None`` and keep their retrieval order after the
+    scored ones. Scores below ``min_score`` mean the passage is off-topic.
+    """
+
+    name = "none"
+    default_min_score = None  # No cutoff
+
+    def __init__(self, min_score: float = None):
+        self.min_score = self.default_min_score if min_score is None else min_score
+
+    def scores(self, query: str, query_embedding: Optional[List[float]], docs: List[Dict]) -> List[Optional[float]]:
+        return [None] * len(docs)
+
+    def rerank(self, query: str, query_embedding: Optional[List[float]], docs: List[Dict]) -> List[Dict]:
+        for doc, score in zip(docs, self.scores(query, query_embedding, docs)):
+            doc['rerank_score'] = score
+        # sorted is stable: unscored documents keep their retrieval order
+        return sorted(docs, key=lambda doc: (doc['rerank_score'] is None, -(doc['rerank_score'] or 0.0)))
+
+    def relevant(self, docs: List[Dict]) -> List[Dict]:
+        """Drop documents scored below the cutoff"""
+        if self.min_score is None:
+            return docs
+        return [doc for doc in docs if doc['rerank_score'] is None or doc['rerank_score'] >= self.min_score]
+
+class CosineReranker(Reranker):
+    """Exact cosine similarity between the query and each chunk's stored full-precision vector.
+
+    Corrects the approximate distances of compressed and graph indexes, and
+    gives keyword-only hits from hybrid retrieval a comparable score.
+    """
+
+    name = "cosine"
+    default_min_score = 0.2  # Cohere v3 query/passage similarity of unrelated text stays below this
+
+    def __init__(self, store, min_score: float = None):
+        super().__init__(min_score)
+        self.store = store
+
+    def scores(self, query: str, query_embedding: Optional[List[float]], docs: List[Dict]) -> List[Optional[float]]:
+        if query_embedding is None:
+            return [None] * len(docs)  # Keyword-only retrieval: nothing to compare against
+        similarities = self.store.cosine_similarities(query_embedding, [doc['vector_id'] for doc in docs])
+        return [similarities.get(doc['vector_id']) for doc in docs]
+
+class TermOverlapReranker(Reranker):
+    """Share of the query's content words found in the passage.
+
+    Needs no model and no network, so it also serves as the local stand-in
+    for the other rerankers in development and tests.
+    """
+
+    name = "term_overlap"
+    default_min_score = 0.25
+
+    @staticmethod
+    def _terms(text: str) -> set:
+        return {term for term in _TERM.findall(text.lower()) if term not in STOPWORDS}
+
+    def scores(self, query: str, query_embedding: Optional[List[float]], docs: List[Dict]) -> List[Optional[float]]:
+        terms = self._terms(query)
+        if not terms:
+            return [None] * len(docs)
+        return [len(terms & self._terms(doc.get('text') or "")) / len(terms) for doc in docs]
+
+class CrossEncoderReranker(Reranker):
+    """A local cross-encoder model that reads the query and passage together (sentence-transformers)"""
+
+    name = "cross_encoder"
+    default_min_score = 0.1  # Sigmoid of the model's relevance logit
+
+    _models: Dict[str, object] = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_name: str = RERANK_MODEL, min_score: float = None):
+        if CrossEncoder is None:
+            raise ValueError("The cross_encoder reranker needs the sentence-transformers package")
+        super().__init__(min_score)
+        with self._models_lock:
+            if model_name not in self._models:
+                self._models[model_name] = CrossEncoder(model_name)
+        self.model = self._models[model_name]
+
+    def scores(self, query: str, query_embedding: Optional[List[float]], docs: List[Dict]) -> List[Optional[float]]:
+        if not docs:
+            return []
+        logits = self.model.predict([(query, doc.get('text') or "") for doc in docs])
+        return [1.0 / (1.0 + math.exp(-float(logit))) for logit in logits]
+
+RERANKERS = ("none", CosineReranker.name, TermOverlapReranker.name, CrossEncoderReranker.name)
+
+def make_reranker(name: str, store, min_score: float = None) -> Reranker:
+    """Build a reranker by name; raises ValueError for an unknown or unavailable one"""
+    if name == CosineReranker.name:
+        return CosineReranker(store, min_score)
+    if name == TermOverlapReranker.name:
+        return TermOverlapReranker(min_score)
+    if name == CrossEncoderReranker.name:
+        return CrossEncoderReranker(min_score=min_score)
+    if name == "none":
+        return Reranker(min_score)
+    raise ValueError(f"Unknown reranker: {name} (choose from {', '.join(RERANKERS)})")
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_store import VectorStore  # noqa: E402
+
+@pytest.fixture
+def open_store(tmp_path):
+    """Open a store on shared files; each instance stands in for a separate worker process"""
+    def open_store(**kwargs):
+        paths = {
+            'index_file': tmp_path / "index.faiss",
+            'metadata_file': tmp_path / "metadata.json",
+            'wal_file': tmp_path / "index.wal",
+            'config_file': tmp_path / "config.json",
+            'vectors_file': tmp_path / "index.vectors",
+            'metadata_db': tmp_path / "metadata.db"
+        }
+        # No background compactions unless a test starts one itself
+        options = {'dim': 16, 'compact_threshold': 10 ** 9}
+        options.update(kwargs)
+        return VectorStore(**{name: str(path) for name, path in paths.items()}, **options)
+    return open_store
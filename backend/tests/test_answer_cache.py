@@ -0,0 +1,20 @@
+from answer_cache import SemanticAnswerCache
+
+SETTINGS = ("model", "bot", 1000)
+DOCS = [{'vector_id': 1, 'doc_id': "a"}, {'vector_id': 2, 'doc_id': "b"}]
+
+def test_similar_queries_over_the_same_chunks_share_an_answer():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put([1.0, 0.0], DOCS, SETTINGS, "Answer")
+    assert cache.get([0.99, 0.05], list(reversed(DOCS)), SETTINGS) == "Answer"
+    assert cache.get([0.0, 1.0], DOCS, SETTINGS) is None
+    assert cache.get([1.0, 0.0], DOCS[:1], SETTINGS) is None
+    cache.invalidate_documents(["b"])
+    assert cache.get([1.0, 0.0], DOCS, SETTINGS) is None
+
+def test_blank_answers_are_not_cached():
+    cache = SemanticAnswerCache()
+    for answer in ("", "  \n"):
+        cache.put([1.0, 0.0], DOCS, SETTINGS, answer)
+    assert cache.stats()['entries'] == 0
+    assert cache.get([1.0, 0.0], DOCS, SETTINGS) is None
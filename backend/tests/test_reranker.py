@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import reranker
+from reranker import CosineReranker, CrossEncoderReranker, Reranker, TermOverlapReranker, make_reranker
+
+DIM = 16  # The open_store fixture's dimension
+
+def _docs(*texts: str) -> list:
+    return [{'vector_id': i, 'text': text} for i, text in enumerate(texts)]
+
+def test_none_keeps_the_retrieval_order(open_store):
+    ranker = make_reranker("none", open_store())
+    docs = ranker.rerank("pricing", None, _docs("a", "b", "c"))
+    assert [doc['vector_id'] for doc in docs] == [0, 1, 2]
+    assert all(doc['rerank_score'] is None for doc in docs)
+    assert ranker.relevant(docs) == docs
+
+def test_cosine_scores_stored_vectors(open_store):
+    store = open_store()
+    vectors = np.random.default_rng(0).standard_normal((3, DIM)).astype('float32')
+    store.add(vectors, [{'doc_id': "d", 'type': 'url', 'source': "s", 'text': f"chunk {i}"} for i in range(3)])
+    ranker = make_reranker("cosine", store)
+    assert isinstance(ranker, CosineReranker)
+
+    candidates = _docs("x", "y", "z") + [{'vector_id': 7, 'text': "not stored"}]
+    docs = ranker.rerank("q", vectors[2].tolist(), candidates)
+    assert docs[0]['vector_id'] == 2
+    assert docs[0]['rerank_score'] == pytest.approx(1.0, abs=1e-5)
+    # An ID without a stored vector cannot be scored and sorts last
+    assert docs[-1]['vector_id'] == 7 and docs[-1]['rerank_score'] is None
+
+    # Keyword-only retrieval has no query embedding: nothing is scored
+    assert all(doc['rerank_score'] is None for doc in ranker.rerank("q", None, _docs("x")))
+
+def test_term_overlap_drops_off_topic_passages():
+    ranker = make_reranker("term_overlap", None)
+    assert isinstance(ranker, TermOverlapReranker)
+    docs = ranker.rerank("What is the refund policy?",
+                         None, _docs("Our office is in Berlin", "The refund policy lasts 30 days", "Refund requests"))
+    assert [doc['rerank_score'] for doc in docs] == [1.0, 0.5, 0.0]
+    assert [doc['vector_id'] for doc in ranker.relevant(docs)] == [1, 2]
+    # Only stopwords: nothing to compare
+    assert ranker.scores("what is it", None, _docs("anything")) == [None]
+
+def test_cross_encoder_scores_with_the_model(monkeypatch):
+    class FakeCrossEncoder:
+        def __init__(self, model_name):
+            self.model_name = model_name
+
+        def predict(self, pairs):
+            return [10.0 if query.split()[0] in passage else -10.0 for query, passage in pairs]
+
+    monkeypatch.setattr(reranker, "CrossEncoder", FakeCrossEncoder)
+    monkeypatch.setattr(CrossEncoderReranker, "_models", {})
+    ranker = make_reranker("cross_encoder", None)
+    docs = ranker.rerank("refunds policy", None, _docs("shipping", "refunds take 30 days"))
+    assert docs[0]['vector_id'] == 1
+    assert docs[0]['rerank_score'] > 0.99 and docs[1]['rerank_score'] < 0.01
+    assert [doc['vector_id'] for doc in ranker.relevant(docs)] == [1]
+
+def test_unavailable_or_unknown_rerankers_are_rejected(monkeypatch):
+    monkeypatch.setattr(reranker, "CrossEncoder", None)
+    with pytest.raises(ValueError):
+        make_reranker("cross_encoder", None)
+    with pytest.raises(ValueError):
+        make_reranker("bm25", None)
+    assert type(make_reranker("none", None)) is Reranker
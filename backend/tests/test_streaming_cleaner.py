@@ -0,0 +1,20 @@
+from data_processor import StreamingResponseCleaner
+
+def _clean(pieces) -> str:
+    cleaner = StreamingResponseCleaner()
+    return "".join(cleaner.feed(piece) for piece in pieces) + cleaner.finish()
+
+def test_think_block_is_dropped_across_chunks():
+    assert _clean(["  <th", "ink>plan", "ning</th", "ink>\n\nThe answer.  "]) == "The answer."
+
+def test_unterminated_think_block_emits_nothing():
+    cleaner = StreamingResponseCleaner()
+    assert cleaner.feed("<think>still reasoning when max_tokens") == ""
+    assert cleaner.feed(" ran out") == ""
+    assert cleaner.finish() == ""
+
+def test_emphasis_split_across_chunks_is_removed():
+    assert _clean(["Open *", "*Monday*", "* to Fri", "day_", "_ only"]) == "Open Monday to Friday only"
+
+def test_text_that_only_resembles_think_is_kept():
+    assert _clean(["<th", "e>x"]) == "<the>x"
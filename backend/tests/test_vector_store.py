@@ -0,0 +1,198 @@
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import VectorStore, fcntl
+
+DIM = 16  # The open_store fixture's dimension
+
+def _vectors(n: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype('float32')
+
+def _metadata(n: int, doc_id: str) -> list:
+    return [{'doc_id': doc_id, 'type': 'url', 'source': f"https://example.com/{doc_id}", 'text': f"{doc_id} chunk {i}"}
+            for i in range(n)]
+
+def _top_id(store: VectorStore, vector: np.ndarray) -> int:
+    return store.search(vector.reshape(1, -1), 1)[0]['vector_id']
+
+def test_log_is_replayed_on_reopen(open_store):
+    store = open_store()
+    vectors = _vectors(5, 0)
+    assert store.add(vectors, _metadata(5, "a")) == [0, 1, 2, 3, 4]
+
+    reopened = open_store()
+    assert reopened.ntotal == 5
+    assert reopened.index.ntotal == 0  # Nothing compacted: everything came from the log
+    assert _top_id(reopened, vectors[3]) == 3
+    assert reopened.search(vectors[3].reshape(1, -1), 1)[0]['text'] == "a chunk 3"
+
+def test_ids_are_never_handed_out_twice_across_processes(open_store):
+    first, second = open_store(), open_store()
+    first_ids = first.add(_vectors(3, 1), _metadata(3, "first"))
+    # The second store has not seen the first one's inserts; add() catches up under the lock
+    second_ids = second.add(_vectors(2, 2), _metadata(2, "second"))
+    assert first_ids == [0, 1, 2]
+    assert second_ids == [3, 4]
+
+    assert first.refresh()
+    assert first.ntotal == 5
+    assert first.add(_vectors(1, 3), _metadata(1, "first")) == [5]
+
+def test_deletes_are_filtered_then_compacted_away(open_store):
+    store = open_store()
+    vectors = _vectors(20, 4)
+    store.add(vectors, _metadata(20, "a"))
+    store.compact()
+
+    assert store.delete([2, 7, 7, 99]) == 2
+    assert store.delete([2]) == 0  # Already deleted
+    other = open_store()
+    for s in (store, other):
+        assert s.ntotal == 18
+        assert _top_id(s, vectors[2]) != 2
+        assert all(r['vector_id'] != 7 for r in s.search(vectors[7].reshape(1, -1), 20))
+    assert store.metadata.get([2, 7]) == {}
+
+    store.compact()
+    assert store.index.ntotal == 18
+    assert not store.tombstones
+    reopened = open_store()
+    assert reopened.ntotal == 18
+    assert _top_id(reopened, vectors[12]) == 12
+    # IDs of deleted vectors are not reused
+    assert reopened.add(_vectors(1, 5), _metadata(1, "b")) == [20]
+
+def test_ids_survive_compaction_and_index_type_changes(open_store):
+    store = open_store()
+    vectors = _vectors(50, 6)
+    store.add(vectors, _metadata(50, "a"))
+    store.delete([0])
+    store.configure("hnsw")
+    assert store.index_type == "hnsw"
+    assert vector_store.index_kind(store.index) == "hnsw"
+
+    reopened = open_store()
+    assert reopened.index_type == "hnsw"
+    assert reopened.ntotal == 49
+    assert _top_id(reopened, vectors[31]) == 31
+    assert reopened.search(vectors[31].reshape(1, -1), 1)[0]['text'] == "a chunk 31"
+
+def test_configure_rejects_non_positive_knobs(open_store):
+    store = open_store()
+    with pytest.raises(ValueError):
+        store.configure(nprobe=-3)
+    with pytest.raises(ValueError):
+        store.configure(ef_search=0)
+    with pytest.raises(ValueError):
+        store.configure("btree", ef_search=5, nprobe=7)
+    # A rejected call changes nothing
+    assert store.ef_search != 5 and store.nprobe != 7
+
+def test_inserts_during_a_rebuild_are_kept(open_store, monkeypatch):
+    store, other = open_store(), open_store()
+    store.add(_vectors(10, 7), _metadata(10, "a"))
+    late = _vectors(3, 8)
+    build_merged = VectorStore._build_merged
+
+    def build_while_another_process_inserts(self, snapshot):
+        index = build_merged(self, snapshot)
+        # The rebuild holds no lock, so this does not wait for it
+        assert other.add(late, _metadata(3, "late")) == [10, 11, 12]
+        other.delete([1])
+        return index
+
+    monkeypatch.setattr(VectorStore, "_build_merged", build_while_another_process_inserts)
+    store.compact()
+
+    assert store.index.ntotal == 10  # The snapshot
+    assert store.delta_index.ntotal == 3  # Logged during the rebuild, carried over
+    assert store.tombstones == {1}
+    reopened = open_store()
+    assert reopened.ntotal == 12
+    assert _top_id(reopened, late[2]) == 12
+
+def test_losing_compaction_is_discarded(open_store, monkeypatch):
+    store, other = open_store(), open_store()
+    vectors = _vectors(10, 9)
+    store.add(vectors, _metadata(10, "a"))
+    build_merged = VectorStore._build_merged
+
+    def build_while_another_process_compacts(self, snapshot):
+        if self is store:
+            other.compact()
+        return build_merged(self, snapshot)
+
+    monkeypatch.setattr(VectorStore, "_build_merged", build_while_another_process_compacts)
+    store.compact()
+
+    assert store.ntotal == 10
+    assert store.index.ntotal == 10  # Picked up the other process's generation
+    assert _top_id(open_store(), vectors[4]) == 4
+
+@pytest.mark.parametrize("fail_at", ["config", "log"])
+def test_interrupted_compaction_leaves_a_loadable_store(open_store, monkeypatch, fail_at):
+    store = open_store()
+    vectors = _vectors(30, 10)
+    store.add(vectors[:20], _metadata(20, "a"))
+    store.compact()
+    store.add(vectors[20:], _metadata(10, "b"))
+    store.delete([3, 29])
+
+    def crash(*args, **kwargs):
+        raise OSError("simulated crash")
+
+    if fail_at == "config":
+        # The new index is in place, but the config still names the old horizon
+        monkeypatch.setattr(VectorStore, "_write_config", crash)
+    else:
+        # Index and config are published, but the log still holds every record
+        atomic_write = vector_store._atomic_write
+        monkeypatch.setattr(vector_store, "_atomic_write",
+                            lambda path, fn: crash() if path == store.wal_file else atomic_write(path, fn))
+    with pytest.raises(OSError):
+        store.compact()
+    monkeypatch.undo()
+
+    reopened = open_store()
+    assert reopened.ntotal == 28
+    assert reopened.next_id == 30
+    assert _top_id(reopened, vectors[25]) == 25
+    assert all(r['vector_id'] not in (3, 29) for r in reopened.search(vectors[29].reshape(1, -1), 30))
+    reopened.compact()
+    assert open_store().ntotal == 28
+    assert reopened.add(_vectors(1, 11), _metadata(1, "c")) == [30]
+
+@pytest.mark.skipif(fcntl is None, reason="needs advisory file locks")
+def test_refresh_serves_the_loaded_index_while_a_writer_holds_the_lock(open_store):
+    store, writer = open_store(), open_store()
+    store.add(_vectors(4, 12), _metadata(4, "a"))
+    writer.add(_vectors(2, 13), _metadata(2, "b"))
+    with writer._wal_lock(exclusive=True):
+        assert store.refresh() is False
+        assert store.ntotal == 4
+    assert store.refresh()
+    assert store.ntotal == 6
+
+def test_bulk_inserts_compact_in_the_background(open_store):
+    store = open_store(compact_threshold=100, compact_ratio=0.5)
+    for batch in range(10):
+        store.add(_vectors(100, 20 + batch), _metadata(100, f"d{batch}"))
+        with store._compacting:
+            pass  # Wait for a background compaction started by this insert
+    assert store.ntotal == 1000
+    assert store.index.ntotal > 0
+    # The log never grows past its share of the base before being compacted
+    assert store._wal_records <= max(100, 0.5 * store.index.ntotal) + 100
+
+def test_exact_vectors_gathers_from_the_base_and_every_delta_batch(open_store):
+    store = open_store()
+    vectors = _vectors(30, 30)
+    store.add(vectors[:10], _metadata(10, "a"))
+    store.compact()
+    store.add(vectors[10:13], _metadata(3, "b"))
+    store.add(vectors[13:30], _metadata(17, "c"))
+    ids = [29, 0, 12, 13, 5, 10, 20]
+    np.testing.assert_array_equal(store.exact_vectors(ids), vectors[ids])
+    assert store.exact_vectors([3, 30]) is None  # Past the last stored ID
+    assert store.exact_vectors([]).shape == (0, DIM)
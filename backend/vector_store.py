@@ -0,0 +1,795 @@
+import os
+import json
+import base64
+import math
+import threading
+from contextlib import contextmanager
+import faiss
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+
+from metadata_store import MetadataStore, METADATA_DB_FILE
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+# Configuration
+EMBEDDING_DIM = 1024
+DATA_STORE_FILE = "company_data_store.faiss"
+METADATA_FILE = "company_metadata.json"  # Legacy metadata list, migrated into METADATA_DB_FILE
+WAL_FILE = "company_data_store.wal"
+WAL_COMPACT_THRESHOLD = int(os.environ.get("WAL_COMPACT_THRESHOLD", "256"))  # Log records before compaction is considered
+# Log records, as a share of the base index, that trigger a background compaction. Growing
+# the threshold with the base keeps bulk loads linear: each rewrite covers a fixed fraction.
+DELTA_COMPACT_RATIO = float(os.environ.get("DELTA_COMPACT_RATIO", "0.1"))
+INDEX_CONFIG_FILE = "company_index_config.json"
+VECTORS_FILE = "company_data_store.vectors"  # Full-precision vectors, memory-mapped for re-ranking
+
+# Index selection and search knobs
+INDEX_TYPES = ("flat_l2", "flat_ip", "hnsw", "ivf", "sq8", "fp16", "pq")
+COMPRESSED_TYPES = ("sq8", "fp16", "pq")
+TRAINED_TYPES = ("ivf", "sq8", "pq")
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat_ip")  # For new stores; existing ones keep their type
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+PQ_SUBQUANTIZERS = 64  # 64 bytes per vector at 8 bits per code
+PQ_BITS = 8
+MIN_TRAIN_VECTORS = 2000  # Below this a trained index type is served by a flat index
+TRAIN_POINTS_PER_CENTROID = 39  # FAISS's k-means warns, and clusters poorly, below this
+RERANK_FACTOR = int(os.environ.get("RERANK_FACTOR", "4"))  # Candidates fetched per result from compressed indexes
+INDEX_MMAP = os.environ.get("INDEX_MMAP", "1") == "1"  # Map the published index instead of reading it into the heap
+TOMBSTONE_COMPACT_RATIO = float(os.environ.get("TOMBSTONE_COMPACT_RATIO", "0.1"))  # Deleted share that triggers a background compaction
+
+def _write_temp(path: str, write_fn) -> str:
+    """Write and fsync a temporary sibling of ``path``; returns the temporary path"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    write_fn(tmp_path)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    return tmp_path
+
+def _atomic_write(path: str, write_fn):
+    """Write a file through a temporary sibling and rename it into place; open readers keep the old file"""
+    os.replace(_write_temp(path, write_fn), path)
+
+def read_published_index(path: str):
+    """Open a published index file, memory-mapped (read-only) when INDEX_MMAP is on"""
+    if INDEX_MMAP:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+    return faiss.read_index(path)
+
+def delta_index_for(index):
+    """Empty exact index, with the same metric, that holds inserts on top of a published index"""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return faiss.IndexIDMap(faiss.IndexFlatIP(index.d))
+    return faiss.IndexIDMap(faiss.IndexFlatL2(index.d))
+
+def unwrap(index):
+    """The index that holds the vectors, below any ID mapping"""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def index_ids(index) -> np.ndarray:
+    """Vector IDs of an index in storage order; indexes without an ID map use their positions"""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map)
+    return np.arange(index.ntotal, dtype='int64')
+
+def ivf_nlist(ntotal: int) -> int:
+    """Number of IVF centroids for a corpus of ``ntotal`` vectors"""
+    return max(1, int(math.sqrt(ntotal)))
+
+def min_train_vectors(index_type: str, ntotal: int = 0) -> int:
+    """Vectors needed to train ``index_type`` well; IVF's centroid count grows with ``ntotal``"""
+    if index_type == "pq":
+        return max(MIN_TRAIN_VECTORS, TRAIN_POINTS_PER_CENTROID * 2 ** PQ_BITS)
+    if index_type == "ivf":
+        return max(MIN_TRAIN_VECTORS, TRAIN_POINTS_PER_CENTROID * ivf_nlist(ntotal))
+    return MIN_TRAIN_VECTORS
+
+def index_kind(index) -> str:
+    """Map a FAISS index to one of INDEX_TYPES"""
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    return "flat_l2" if index.metric_type == faiss.METRIC_L2 else "flat_ip"
+
+def bytes_per_vector(index) -> float:
+    """Resident memory the index spends per stored vector"""
+    if isinstance(index, faiss.IndexIDMap):
+        return bytes_per_vector(unwrap(index)) + 8  # Plus the stored ID
+    if isinstance(index, faiss.IndexHNSW):
+        links = faiss.vector_to_array(index.hnsw.neighbors).size * 4
+        return index.storage.sa_code_size() + (links / index.ntotal if index.ntotal else 2 * HNSW_M * 4)
+    if isinstance(index, faiss.IndexIVF):
+        return index.code_size + 8  # Codes plus the stored ID in the inverted list
+    return index.sa_code_size()
+
+def build_index(index_type: str, dim: int, vectors: Optional[np.ndarray] = None,
+                ids: Optional[np.ndarray] = None):
+    """Create an ID-mapped index of the given type, trained on and filled with ``vectors``"""
+    ntotal = 0 if vectors is None else len(vectors)
+    if index_type in TRAINED_TYPES and ntotal < min_train_vectors(index_type, ntotal):
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "flat_l2":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "flat_ip":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "ivf":
+        index = faiss.index_factory(dim, f"IVF{ivf_nlist(ntotal)},Flat", faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    elif index_type == "fp16":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "pq":
+        index = faiss.IndexPQ(dim, PQ_SUBQUANTIZERS, PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    index = faiss.IndexIDMap(index)
+    if ntotal:
+        index.add_with_ids(vectors, np.arange(ntotal, dtype='int64') if ids is None else ids)
+    return index
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return an L2-normalized float32 copy of ``vectors``"""
+    vectors = np.array(vectors, dtype='float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def all_vectors(index) -> np.ndarray:
+    """Reconstruct every vector stored in an index in storage order (lossy for compressed types)"""
+    index = unwrap(index)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype='float32')
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+class ReadWriteLock:
+    """Many concurrent readers or a single writer; waiting writers block new readers"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+class VectorStore:
+    """FAISS index kept resident in memory, with chunk metadata in SQLite.
+
+    A memory-mapped published base index plus an in-heap delta of logged
+    inserts and tombstoned deletes, compacted into a new base in the
+    background. Vector IDs are stable and never reused.
+    """
+
+    def __init__(self, index_file: str = DATA_STORE_FILE, metadata_file: str = METADATA_FILE,
+                 wal_file: str = WAL_FILE, config_file: str = INDEX_CONFIG_FILE,
+                 vectors_file: str = VECTORS_FILE, dim: int = EMBEDDING_DIM,
+                 compact_threshold: int = WAL_COMPACT_THRESHOLD, metadata_db: str = METADATA_DB_FILE,
+                 compact_ratio: float = DELTA_COMPACT_RATIO):
+        self.index_file = index_file
+        self.metadata_file = metadata_file
+        self.wal_file = wal_file
+        self.config_file = config_file
+        self.vectors_file = vectors_file
+        self.dim = dim
+        self.compact_threshold = compact_threshold
+        self.compact_ratio = compact_ratio
+
+        self.index_type = None
+        self.ef_search = HNSW_EF_SEARCH
+        self.nprobe = IVF_NPROBE
+
+        self.index = None  # Published base index, read-only
+        self.delta_index = None  # Inserts since the last compaction
+        self.metadata = MetadataStore(metadata_db)
+        self._base_ids = np.zeros(0, dtype='int64')  # IDs stored in the base index
+        self._base_rows = 0  # IDs below this were compacted into the base (and the vectors file)
+        self.next_id = 0
+        self.tombstones = set()  # Deleted IDs still present in the base or delta index
+        self._selector = None  # Search-time filter for the tombstones
+        self._base_vectors = None  # Memory map of the compacted full-precision vectors
+        self._delta_vectors: List[np.ndarray] = []  # Vectors logged since the last compaction
+        self._delta_ends: List[int] = []  # Delta rows up to the end of each of those batches
+        self.lock = ReadWriteLock()
+        # Serializes writers (reloads, inserts, deletes, compaction) within this process
+        self._mutex = threading.RLock()
+        self._compacting = threading.Lock()  # A background compaction is scheduled or running
+        self._compaction = threading.Lock()  # One compaction at a time in this process
+        self.generation = 0
+        self._stamp = None
+        self._wal_offset = 0
+        self._wal_records = 0
+        self.refresh()
+
+    def _base_stamp(self) -> Tuple[Optional[Tuple[int, int, int]], ...]:
+        """Return (inode, mtime, size) for the index and config files, or None if missing"""
+        stamp = []
+        for path in (self.index_file, self.config_file):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _wal_size(self) -> int:
+        try:
+            return os.path.getsize(self.wal_file)
+        except OSError:
+            return 0
+
+    @contextmanager
+    def _wal_lock(self, exclusive: bool, blocking: bool = True):
+        """Hold the advisory lock file next to the log; yields whether the lock was taken"""
+        with open(f"{self.wal_file}.lock", 'ab') as f:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+                try:
+                    fcntl.flock(f, flags if blocking else flags | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            try:
+                yield True
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self) -> bool:
+        """Reload the store if the files on disk changed, skipping a round rather than waiting on a lock"""
+        if self.index is not None and self._base_stamp() == self._stamp and self._wal_size() == self._wal_offset:
+            return False
+        with self._mutex, self._wal_lock(exclusive=False, blocking=self.index is None) as locked:
+            return self._refresh_locked() if locked else False
+
+    def _refresh_locked(self) -> bool:
+        stamp = self._base_stamp()
+        wal_size = self._wal_size()
+        if self.index is not None and stamp == self._stamp:
+            if wal_size == self._wal_offset:
+                return False
+            if wal_size > self._wal_offset:
+                # Another process appended to the log: replay only the new tail
+                ids, vectors, deleted, legacy_metadata, offset, count = self._read_wal(self._wal_offset, self.next_id)
+                self.metadata.put(legacy_metadata)
+                with self.lock.write():
+                    if vectors is not None:
+                        self.delta_index.add_with_ids(self._prepare(vectors, self.delta_index), ids)
+                        self._append_delta_vectors(vectors)
+                        self.next_id = int(ids[-1]) + 1
+                    self._set_tombstones(self.tombstones | self._present(deleted))
+                self._wal_offset = offset
+                self._wal_records += count
+                self.generation += 1
+                return True
+        self._load()
+        return True
+
+    def _load(self, index=None):
+        """Load the published generation (``index``, if already opened) and replay the whole log on top"""
+        stamp = self._base_stamp()
+        config = self._read_config()
+        if index is not None or os.path.exists(self.index_file):
+            index = index if index is not None else read_published_index(self.index_file)
+            self.metadata.migrate_json(self.metadata_file)
+            index_type = config.get('index_type') or index_kind(index)
+        else:
+            index_type = config.get('index_type') or INDEX_TYPE
+            index = build_index(index_type, self.dim)
+        base_ids = index_ids(index)
+        # The config can lag behind the index if a compaction was interrupted
+        base_rows = max(config.get('next_id', 0), int(base_ids.max()) + 1 if len(base_ids) else 0)
+        base_vectors = self._load_base_vectors(index, base_ids, base_rows)
+        delta_index = delta_index_for(index)
+        ids, vectors, deleted, legacy_metadata, offset, count = self._read_wal(0, base_rows)
+        if vectors is not None:
+            # Records below base_rows were already compacted into the base index
+            keep = ids >= base_rows
+            ids, vectors = ids[keep], vectors[keep]
+            legacy_metadata = {i: meta for i, meta in legacy_metadata.items() if i >= base_rows}
+            delta_index.add_with_ids(self._prepare(vectors, delta_index), ids)
+        self.metadata.put(legacy_metadata)
+
+        # Swap the new generation in atomically with respect to searches
+        with self.lock.write():
+            self.index = index
+            self.delta_index = delta_index
+            self.index_type = index_type
+            self._base_ids = base_ids
+            self._base_rows = base_rows
+            self.next_id = int(ids[-1]) + 1 if vectors is not None and len(ids) else base_rows
+            self._base_vectors = base_vectors
+            self._delta_vectors, self._delta_ends = [], []
+            if vectors is not None and len(ids):
+                self._append_delta_vectors(vectors)
+            self._set_tombstones(self._present(deleted))
+        self._stamp = stamp
+        self._wal_offset = offset
+        self._wal_records = count
+        self.generation += 1
+
+    def _present(self, ids) -> set:
+        """The given IDs that are still stored in the base or delta index"""
+        ids = np.array(sorted(ids), dtype='int64')
+        in_delta = (ids >= self._base_rows) & (ids < self.next_id)
+        return set(ids[in_delta | np.isin(ids, self._base_ids)].tolist())
+
+    def _set_tombstones(self, tombstones: set):
+        self.tombstones = tombstones
+        if tombstones:
+            batch = faiss.IDSelectorBatch(np.array(sorted(tombstones), dtype='int64'))
+            # Keep the batch alive alongside the selector that points to it
+            self._selector = (faiss.IDSelectorNot(batch), batch)
+        else:
+            self._selector = None
+
+    def _map_vectors(self, rows: int) -> Optional[np.ndarray]:
+        """Memory-map the first ``rows`` full-precision vectors, or None if the file is short"""
+        row_bytes = self.dim * 4
+        try:
+            if os.path.getsize(self.vectors_file) < rows * row_bytes:
+                return None
+        except OSError:
+            return None
+        if rows == 0:
+            return np.zeros((0, self.dim), dtype='float32')
+        return np.memmap(self.vectors_file, dtype='float32', mode='r', shape=(rows, self.dim))
+
+    def _load_base_vectors(self, index, base_ids: np.ndarray, rows: int) -> Optional[np.ndarray]:
+        """Map the full-precision vectors of a freshly loaded base index, backfilling the file if needed"""
+        mapped = self._map_vectors(rows)
+        if mapped is not None:
+            return mapped
+        if index_kind(index) in COMPRESSED_TYPES:
+            print("Full-precision vectors are missing; compressed search results will not be re-ranked")
+            return None
+        # Stores written before the vectors file existed: recover it from the exact index
+        vectors = np.zeros((rows, self.dim), dtype='float32')
+        vectors[base_ids] = all_vectors(index)
+        _atomic_write(self.vectors_file, lambda path: vectors.tofile(path))
+        return self._map_vectors(rows)
+
+    def _write_vectors(self, snapshot: Dict):
+        """Write the snapshot's logged vectors into their rows (row ``i`` holds vector ``i``) of the vectors file"""
+        if snapshot['base_vectors'] is None or not snapshot['delta_vectors']:
+            return  # Compressed store without exact vectors, or nothing new
+        with open(self.vectors_file, 'r+b') as f:
+            f.seek(snapshot['base_rows'] * self.dim * 4)
+            for vectors in snapshot['delta_vectors']:
+                f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _live_vectors(snapshot: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """IDs and vectors of everything not deleted, exact where the full-precision vectors exist"""
+        ids = np.concatenate([snapshot['base_ids'],
+                              np.arange(snapshot['base_rows'], snapshot['next_id'], dtype='int64')])
+        if snapshot['base_vectors'] is not None:
+            base = snapshot['base_vectors'][snapshot['base_ids']]
+        else:
+            base = all_vectors(snapshot['index'])
+        vectors = np.vstack([base] + snapshot['delta_vectors'])
+        keep = ~np.isin(ids, np.array(sorted(snapshot['tombstones']), dtype='int64'))
+        return ids[keep], vectors[keep]
+
+    def _append_delta_vectors(self, vectors: np.ndarray):
+        self._delta_vectors.append(vectors)
+        self._delta_ends.append((self._delta_ends[-1] if self._delta_ends else 0) + len(vectors))
+
+    def exact_vectors(self, ids) -> Optional[np.ndarray]:
+        """Full-precision vectors for the given vector IDs, or None if they are not available"""
+        if self._base_vectors is None:
+            return None
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        delta_rows = self._delta_ends[-1] if self._delta_ends else 0
+        if len(ids) and (ids.min() < 0 or ids.max() >= self._base_rows + delta_rows):
+            return None
+        vectors = np.empty((len(ids), self.dim), dtype='float32')
+        in_base = ids < self._base_rows
+        vectors[in_base] = self._base_vectors[ids[in_base]]
+        # Delta IDs are contiguous from _base_rows: find each one's batch, then gather per batch
+        rows = ids[~in_base] - self._base_rows
+        if len(rows):
+            positions = np.flatnonzero(~in_base)
+            batches = np.searchsorted(self._delta_ends, rows, side='right')
+            for batch in np.unique(batches):
+                picked = batches == batch
+                start = self._delta_ends[batch - 1] if batch else 0
+                vectors[positions[picked]] = self._delta_vectors[batch][rows[picked] - start]
+        return vectors
+
+    def cosine_similarities(self, query_vector, vector_ids: List[int]) -> Dict[int, float]:
+        """Exact cosine similarity of a query to stored full-precision vectors; IDs without one are left out"""
+        vector_ids = [int(idx) for idx in vector_ids]
+        with self.lock.read():
+            vectors = self.exact_vectors(vector_ids)
+            if vectors is None:
+                # Some IDs have no stored vector (deleted, or no vectors file yet): score the rest
+                found = [(idx, self.exact_vectors([idx])) for idx in vector_ids]
+                found = [(idx, vector[0]) for idx, vector in found if vector is not None]
+                vector_ids = [idx for idx, _ in found]
+                vectors = np.array([vector for _, vector in found], dtype='float32').reshape(-1, self.dim)
+        if not vector_ids:
+            return {}
+        query = normalize(np.asarray(query_vector, dtype='float32').reshape(1, -1))[0]
+        return dict(zip(vector_ids, (normalize(vectors) @ query).tolist()))
+
+    def _read_config(self) -> Dict:
+        try:
+            with open(self.config_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_config(self, index_type: str, next_id: int):
+        config = {'index_type': index_type, 'next_id': next_id}
+        _atomic_write(self.config_file, lambda path: self._write_json(path, config))
+
+    def _prepare(self, vectors: np.ndarray, index) -> np.ndarray:
+        """Normalize vectors for inner-product indexes so scores are cosine similarities"""
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return normalize(vectors)
+        return np.ascontiguousarray(vectors, dtype='float32')
+
+    def _read_wal(self, offset: int, next_id: int):
+        """Read log records after ``offset``: (ids, vectors, deleted ids, legacy metadata, new offset, record count)"""
+        ids = []
+        vectors = []
+        deleted = set()
+        legacy_metadata = {}
+        count = 0
+        if os.path.exists(self.wal_file):
+            with open(self.wal_file, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Torn write still in progress; pick it up next time
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                        if 'delete' in record:
+                            deleted.update(int(i) for i in record['delete'])
+                            count += 1
+                            continue
+                        vector = np.frombuffer(base64.b64decode(record['vector']), dtype='float32')
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"Skipping corrupt WAL record: {e}")
+                        continue
+                    vector_id = record.get('id', next_id)
+                    next_id = vector_id + 1
+                    if 'metadata' in record:
+                        legacy_metadata[vector_id] = record['metadata']
+                    ids.append(vector_id)
+                    vectors.append(vector)
+                    count += 1
+        if not vectors:
+            return np.zeros(0, dtype='int64'), None, deleted, legacy_metadata, offset, count
+        return np.array(ids, dtype='int64'), np.vstack(vectors), deleted, legacy_metadata, offset, count
+
+    def _append_wal(self, lines: List[str]):
+        payload = "".join(lines).encode('utf-8')
+        with open(self.wal_file, 'ab') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._wal_offset += len(payload)
+        self._wal_records += len(lines)
+
+    def add(self, embeddings: list, metadata: List[Dict]) -> List[int]:
+        """Add vectors to the delta index, log them and store their metadata; returns their IDs"""
+        vectors = np.asarray(embeddings, dtype='float32').reshape(-1, self.dim)
+
+        with self._mutex, self._wal_lock(exclusive=True):
+            # Catch up with records other processes logged so IDs are never handed out twice
+            self._refresh_locked()
+            ids = np.arange(self.next_id, self.next_id + len(vectors), dtype='int64')
+            lines = []
+            for vector_id, vector in zip(ids, vectors):
+                record = {'id': int(vector_id), 'vector': base64.b64encode(vector.tobytes()).decode('ascii')}
+                lines.append(json.dumps(record) + "\n")
+            # Log first: a crash before the metadata commit leaves vectors that searches skip
+            self._append_wal(lines)
+            self.metadata.put({int(vector_id): meta for vector_id, meta in zip(ids, metadata)})
+            with self.lock.write():
+                self.delta_index.add_with_ids(self._prepare(vectors, self.delta_index), ids)
+                self._append_delta_vectors(vectors)
+                self.next_id += len(vectors)
+            self.generation += 1
+
+        if self._should_compact():
+            self.compact_in_background()
+        return ids.tolist()
+
+    def delete(self, vector_ids) -> int:
+        """Tombstone vectors and drop their metadata; returns how many were live"""
+        with self._mutex, self._wal_lock(exclusive=True):
+            self._refresh_locked()
+            ids = sorted(self._present(int(i) for i in vector_ids) - self.tombstones)
+            if not ids:
+                return 0
+            self._append_wal([json.dumps({'delete': ids}) + "\n"])
+            self.metadata.delete(ids)
+            with self.lock.write():
+                self._set_tombstones(self.tombstones | set(ids))
+            self.generation += 1
+
+        if self._should_compact():
+            self.compact_in_background()
+        return len(ids)
+
+    def _should_compact(self) -> bool:
+        """Whether the log, the deletes or the index type call for a compaction"""
+        if self._wal_records >= max(self.compact_threshold, self.compact_ratio * self.index.ntotal):
+            return True
+        stored = self.index.ntotal + self.delta_index.ntotal
+        if self.tombstones and len(self.tombstones) >= TOMBSTONE_COMPACT_RATIO * stored:
+            return True
+        return self._needs_rebuild()
+
+    def _needs_rebuild(self) -> bool:
+        """Whether the index no longer matches the configured type or has outgrown its centroids"""
+        if not isinstance(self.index, faiss.IndexIDMap):
+            return True  # Written before vector IDs were stable: IDs are still positions
+        kind = index_kind(self.index)
+        if self.index_type in TRAINED_TYPES:
+            if kind == "ivf" == self.index_type:
+                # Retrain once the corpus calls for twice as many centroids
+                return ivf_nlist(self.ntotal) >= 2 * unwrap(self.index).nlist
+            if kind == self.index_type:
+                return False
+            return kind != "flat_ip" or self.ntotal >= min_train_vectors(self.index_type, self.ntotal)
+        return kind != self.index_type
+
+    def _snapshot(self) -> Dict:
+        """Everything a compaction needs from the current generation; call with the log lock held"""
+        with self.lock.read():
+            return {
+                'stamp': self._stamp,
+                'wal_offset': self._wal_offset,
+                'index_type': self.index_type,
+                'index': self.index,
+                'base_ids': self._base_ids,
+                'base_rows': self._base_rows,
+                'next_id': self.next_id,
+                'base_vectors': self._base_vectors,
+                'delta_vectors': list(self._delta_vectors),  # The arrays themselves are never modified
+                'tombstones': set(self.tombstones),
+                'rebuild': self._needs_rebuild() or bool(self.tombstones)
+            }
+
+    def _build_merged(self, snapshot: Dict):
+        """Build, in the heap, the index that the compaction of ``snapshot`` publishes"""
+        if snapshot['rebuild']:
+            ids, vectors = self._live_vectors(snapshot)
+            if snapshot['index_type'] != "flat_l2":
+                vectors = normalize(vectors)
+            index = build_index(snapshot['index_type'], self.dim, vectors, ids)
+            print(f"Rebuilt {snapshot['index_type']} index over {index.ntotal} vectors")
+            return index
+
+        # The published base is read-only (possibly mapped), so start from a private copy.
+        # If the file was replaced meanwhile, the stamp check before publishing catches it
+        if os.path.exists(self.index_file):
+            index = faiss.read_index(self.index_file)
+        else:
+            index = faiss.clone_index(snapshot['index'])
+        if snapshot['delta_vectors']:
+            vectors = self._prepare(np.vstack(snapshot['delta_vectors']), index)
+            index.add_with_ids(vectors, np.arange(snapshot['base_rows'], snapshot['next_id'], dtype='int64'))
+        return index
+
+    def configure(self, index_type: str = None, ef_search: int = None, nprobe: int = None):
+        """Change the index type (rebuilding the index if needed) and the default search knobs"""
+        # Validate everything before changing anything
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+        for name, value in (("ef_search", ef_search), ("nprobe", nprobe)):
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be a positive integer")
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if index_type is None or index_type == self.index_type:
+            return
+        with self._mutex, self._wal_lock(exclusive=True):
+            self._refresh_locked()
+            self.index_type = index_type
+            self._write_config(index_type, self._base_rows)
+            self._stamp = self._base_stamp()
+        self.compact()
+
+    def compact(self):
+        """Publish base plus logged inserts, minus deletes, as a new index generation"""
+        with self._compaction:
+            with self._mutex, self._wal_lock(exclusive=False):
+                self._refresh_locked()
+                snapshot = self._snapshot()
+            if snapshot['wal_offset'] == 0 and not snapshot['rebuild'] and os.path.exists(self.index_file):
+                return  # The published index is already current
+
+            merged = self._build_merged(snapshot)
+            self._write_vectors(snapshot)
+            tmp_path = _write_temp(self.index_file, lambda path: faiss.write_index(merged, path))
+            del merged
+            try:
+                # Opened before the rename: the mapping follows the file into place
+                published = read_published_index(tmp_path)
+                with self._mutex, self._wal_lock(exclusive=True):
+                    if self._base_stamp() != snapshot['stamp']:
+                        print("Another process published a newer index generation; discarding this compaction")
+                        self._refresh_locked()
+                        return
+                    with open(self.wal_file, 'ab+') as f:
+                        f.seek(snapshot['wal_offset'])
+                        tail = f.read()
+
+                    # Every step leaves a loadable store: records the new index covers are
+                    # skipped by ID on load until the log is cut down to the tail
+                    os.replace(tmp_path, self.index_file)
+                    self._write_config(snapshot['index_type'], snapshot['next_id'])
+                    _atomic_write(self.wal_file, lambda path: self._write_bytes(path, tail))
+                    # Rows of deleted vectors normally went at delete time; this catches interrupted deletes
+                    self.metadata.delete(snapshot['tombstones'])
+
+                    # Switch this process to the published generation; the others follow on refresh
+                    self._load(published)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def compact_in_background(self):
+        """Start a compaction on a daemon thread unless one is already running"""
+        if not self._compacting.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Background compaction error: {e}")
+            finally:
+                self._compacting.release()
+
+        threading.Thread(target=run, name="vector-compaction", daemon=True).start()
+
+    @staticmethod
+    def _write_json(path: str, data):
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+    @staticmethod
+    def _write_bytes(path: str, data: bytes):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def save(self):
+        """Write the full index to disk, folding in any logged inserts and deletes"""
+        self.compact()
+
+    def _search_params(self, index, ef_search: int = None, nprobe: int = None):
+        index = unwrap(index)
+        sel = self._selector[0] if self._selector else None
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch=ef_search or self.ef_search, sel=sel)
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(nprobe=nprobe or self.nprobe, sel=sel)
+        if isinstance(index, faiss.IndexPQ) or sel is None:
+            return None  # IndexPQ takes no search parameters; its deletes are filtered afterwards
+        return faiss.SearchParameters(sel=sel)
+
+    def search(self, query_vectors: np.ndarray, k: int, ef_search: int = None, nprobe: int = None) -> List[Dict]:
+        """Return the metadata, ``vector_id`` and ``score`` (higher is better) of the ``k`` nearest live vectors"""
+        with self.lock.read():
+            if self.ntotal == 0:
+                return []
+            query = self._prepare(query_vectors, self.index)
+            is_ip = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+            # (distance, vector id) candidates from the published base and the delta
+            candidates = []
+            if self.index.ntotal:
+                params = self._search_params(self.index, ef_search, nprobe)
+                fetch = k
+                if self.tombstones and params is None:
+                    fetch += len(self.tombstones)  # Deletes are filtered after the search
+                if index_kind(self.index) in COMPRESSED_TYPES:
+                    distances, indices = self._search_reranked(query, fetch, params)
+                else:
+                    distances, indices = self.index.search(query, fetch, params=params)
+                candidates.extend(zip(distances[0], indices[0]))
+            if self.delta_index.ntotal:
+                params = self._search_params(self.delta_index)
+                distances, indices = self.delta_index.search(query, min(k, self.delta_index.ntotal), params=params)
+                candidates.extend(zip(distances[0], indices[0]))
+            hits = [(float(d), int(i)) for d, i in candidates if i >= 0 and i not in self.tombstones]
+            hits = sorted(hits, key=lambda c: -c[0] if is_ip else c[0])[:k]
+
+        # Metadata and text are only read for the hits that are returned
+        records = self.metadata.get(idx for _, idx in hits)
+        results = []
+        for distance, idx in hits:
+            if idx in records:
+                result = records[idx]
+                result['vector_id'] = idx
+                result['distance'] = distance
+                result['score'] = distance if is_ip else -distance
+                results.append(result)
+        return results
+
+    def _search_reranked(self, query: np.ndarray, k: int, params):
+        """Over-fetch from a compressed index and re-rank by exact cosine similarity"""
+        distances, indices = self.index.search(query, k * RERANK_FACTOR, params=params)
+        candidates = [int(idx) for idx in indices[0] if idx >= 0]
+        vectors = self.exact_vectors(candidates)
+        if vectors is None:
+            return distances[:, :k], indices[:, :k]
+        scores = normalize(vectors) @ query[0]
+        order = np.argsort(-scores)[:k]
+        return scores[order][None, :], np.array([candidates[i] for i in order], dtype='int64')[None, :]
+
+    def memory_stats(self) -> Dict:
+        """Size of the index per vector; the published part is shared through the page cache"""
+        with self.lock.read():
+            per_vector = bytes_per_vector(self.index)
+            return {
+                'index_type': index_kind(self.index),
+                'bytes_per_vector': round(per_vector, 1),
+                'index_bytes': int(per_vector * self.index.ntotal),
+                'delta_bytes': int(bytes_per_vector(self.delta_index) * self.delta_index.ntotal),
+                'tombstones': len(self.tombstones),
+                'mmap': INDEX_MMAP
+            }
+
+    @property
+    def ntotal(self) -> int:
+        """Number of live (not deleted) vectors"""
+        return self.index.ntotal + self.delta_index.ntotal - len(self.tombstones)